@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checks the consistency of the VLANs across the explored network once the
+crawl is over. The VLANs of an interface are held as bitsets (Python ints of
+4096 bits, one bit per VLAN identifier), so that a whole link or device is
+compared with a single bitwise operation.
+"""
+
+import operator
+
+from network_objects import VlanMode
+
+MAX_VLAN_IDENTIFIER = 4095
+
+# The bit of each VLAN identifier, as written by the devices
+_BITS = dict((str(i), 1 << i) for i in range(MAX_VLAN_IDENTIFIER + 1))
+
+_get_mode = operator.attrgetter("mode")
+
+
+def _to_bits(identifiers):
+    # The bits are distinct, so their sum is their union
+    return sum(map(_BITS.get, identifiers, [0] * len(identifiers)))
+
+
+def _to_bitsets(interface):
+    """
+    Returns the tagged and the untagged VLANs of an interface as bitsets.
+    VLANs whose identifier is not a number are ignored.
+    """
+    identifiers = interface.vlans.keys()
+    modes = map(_get_mode, interface.vlans.values())
+
+    # Most interfaces are trunks whose VLANs are all tagged
+    if VlanMode.ACCESS not in modes:
+        return _to_bits(identifiers), 0
+
+    untagged = [i for i, m in zip(identifiers, modes) if m == VlanMode.ACCESS]
+    tagged = [i for i, m in zip(identifiers, modes) if m != VlanMode.ACCESS]
+    return _to_bits(tagged), _to_bits(untagged)
+
+
+def _to_identifiers(bits):
+    identifiers = []
+    while bits:
+        lowest = bits & -bits
+        identifiers.append(str(lowest.bit_length() - 1))
+        bits ^= lowest
+    return identifiers
+
+
+def analyze_vlans(topology):
+    """
+    Finds the VLANs which differ between the two ends of a link, the devices
+    each VLAN reaches and the VLANs of each device which none of its links
+    carries to another device.
+
+    :param topology: The explored devices and their links
+    :type topology: Topology
+    :return: The 'mismatches', 'reach' and 'orphans' of the network
+    :rtype: dict
+    """
+    devices = topology.devices
+
+    bitsets = {}
+    device_bits = {}
+    for mac_address, device in devices.iteritems():
+        bits = 0
+        for interface in device.interfaces.itervalues():
+            tagged, untagged = bitsets[id(interface)] = _to_bitsets(interface)
+            bits |= tagged | untagged
+        device_bits[mac_address] = bits
+
+    mismatches = []
+    carried = dict.fromkeys(devices, 0)
+    for device, interface, remote_device, remote_interface in \
+            topology.get_links():
+        tagged, untagged = bitsets[id(interface)]
+        remote_tagged, remote_untagged = bitsets[id(remote_interface)]
+
+        carried_bits = (tagged | untagged) & (remote_tagged | remote_untagged)
+        carried[device.mac_address] |= carried_bits
+        carried[remote_device.mac_address] |= carried_bits
+
+        tagged_mismatch = tagged ^ remote_tagged
+        untagged_mismatch = untagged ^ remote_untagged
+        if tagged_mismatch or untagged_mismatch:
+            mismatches.append({
+                "from": device.mac_address,
+                "from_port": interface.local_port,
+                "to": remote_device.mac_address,
+                "to_port": remote_interface.local_port,
+                "tagged": _to_identifiers(tagged_mismatch),
+                "untagged": _to_identifiers(untagged_mismatch)})
+
+    # Most devices carry the same VLANs, which are listed once
+    devices_by_bits = {}
+    for mac_address, bits in device_bits.iteritems():
+        devices_by_bits.setdefault(bits, []).append(mac_address)
+
+    reach = {}
+    for bits, mac_addresses in devices_by_bits.iteritems():
+        for identifier in _to_identifiers(bits):
+            reach.setdefault(identifier, []).extend(mac_addresses)
+    for mac_addresses in reach.itervalues():
+        mac_addresses.sort()
+
+    orphans = {}
+    for mac_address, bits in device_bits.iteritems():
+        # A device which has no link at all is not explored enough to tell
+        orphan_bits = bits & ~carried[mac_address]
+        if orphan_bits and carried[mac_address]:
+            orphans[mac_address] = _to_identifiers(orphan_bits)
+
+    return {"mismatches": mismatches, "reach": reach, "orphans": orphans}
+
+
+import unittest
+from network_objects import Device, Interface, Vlan, VlanMode
+from topology import Topology
+
+
+class AnalysisTester(unittest.TestCase):
+    def _device(self, mac_address, *interfaces):
+        return Device(mac_address=mac_address,
+                      interfaces=dict((i.local_port, i) for i in interfaces))
+
+    def _interface(self, local_port, remote_mac_address, remote_port,
+                   tagged=(), untagged=()):
+        interface = Interface(local_port=local_port, remote_port=remote_port,
+                              remote_mac_address=remote_mac_address)
+        for identifier in tagged:
+            interface.add_vlan(Vlan(identifier, mode=VlanMode.TRUNK))
+        for identifier in untagged:
+            interface.add_vlan(Vlan(identifier, mode=VlanMode.ACCESS))
+        return interface
+
+    def setUp(self):
+        self.devices = {
+            "a": self._device(
+                "a", self._interface("1", "b", "ge-0/0/1..",
+                                     tagged=["10", "20"], untagged=["1"]),
+                self._interface("2", "c", "24", tagged=["30"])),
+            "b": self._device(
+                "b", self._interface("ge-0/0/1.0", "a", "1",
+                                     tagged=["10", "4000"], untagged=["1"])),
+            "c": self._device(
+                "c", self._interface("24", "a", "2", tagged=["30", "vlan"]))}
+
+    def test_analysis(self):
+        analysis = analyze_vlans(Topology(self.devices))
+        self.assertEqual(analysis["mismatches"], [
+            {"from": "a", "from_port": "1", "to": "b",
+             "to_port": "ge-0/0/1.0", "tagged": ["20", "4000"],
+             "untagged": []}])
+        self.assertEqual(analysis["reach"]["1"], ["a", "b"])
+        self.assertEqual(analysis["reach"]["30"], ["a", "c"])
+        self.assertEqual(analysis["orphans"], {"a": ["20"], "b": ["4000"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
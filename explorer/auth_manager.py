@@ -2,7 +2,10 @@
 
 import ConfigParser
 import fnmatch
+import hashlib
+import logging
 import os
+import re
 
 import paramiko
 
@@ -15,6 +18,79 @@ class AuthConfigError(Exception):
     pass
 
 
+# Types of private keys, tried in this order when loading a key file
+KEY_CLASSES = [getattr(paramiko, name) for name in
+               ("RSAKey", "ECDSAKey", "Ed25519Key", "DSSKey")
+               if hasattr(paramiko, name)]
+
+
+def load_private_key(path, password=None):
+    """
+    Loads a private key file of any type supported by paramiko.
+    """
+    error = None
+    for key_class in KEY_CLASSES:
+        try:
+            return key_class.from_private_key_file(path, password)
+        except paramiko.PasswordRequiredException:
+            raise
+        except paramiko.SSHException as e:
+            error = e
+
+    raise error
+
+
+class HostPatternMatcher(object):
+    """
+    Finds the first of an ordered list of fnmatch patterns matching a name.
+
+    The patterns are compiled once: names without wildcards are looked up in
+    a dict, and the other patterns are grouped by their literal prefix so
+    that only the groups sharing a prefix with the name are tried. The cost
+    of a lookup hardly depends on the number of patterns.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: The (pattern, value) pairs, in order of priority
+        :type rules: [(str, object)]
+        """
+        self._exact = {}
+        self._globs = {}
+
+        for index, (pattern, value) in enumerate(rules):
+            prefix_length = min([pattern.find(c) for c in "*?["
+                                 if c in pattern] or [len(pattern)])
+
+            if prefix_length == len(pattern):
+                self._exact.setdefault(pattern, (index, value))
+            else:
+                regex = re.compile(fnmatch.translate(pattern))
+                self._globs.setdefault(pattern[:prefix_length], []).append(
+                    (index, regex, value))
+
+        self._prefix_lengths = sorted(set(len(p) for p in self._globs))
+
+    def match(self, name):
+        """
+        Returns the value of the first pattern matching the name, or None.
+        """
+        best = self._exact.get(name)
+
+        for length in self._prefix_lengths:
+            if length > len(name):
+                break
+
+            for index, regex, value in self._globs.get(name[:length], ()):
+                if best is not None and best[0] < index:
+                    break
+                if regex.match(name):
+                    best = (index, value)
+                    break
+
+        return best[1] if best is not None else None
+
+
 class AuthManager(object):
     def __init__(self, parser):
         """
@@ -23,12 +99,52 @@ class AuthManager(object):
         """
         self._parser = parser
 
+        # Options of the sections already resolved, with their keys loaded
+        self._options_cache = {}
+
+        # Built from the [Auth] section on the first lookup
+        self._host_matcher = None
+
+    def preload(self):
+        """
+        Resolves every auth section and loads its key once, so that the
+        workers exploring the devices can share them ready to use.
+        """
+        for section in self._parser.sections():
+            if not section.startswith("Auth.") or \
+               self._parser.has_option(section, "credentials"):
+                continue
+            try:
+                self._get_options(section)
+            except Exception as e:
+                logging.warning("Could not load auth section %s: %s",
+                                section, e)
+
+    def get_digest(self):
+        """
+        Returns a digest of the [Auth] and [Auth.*] sections, which changes
+        whenever the credentials or the hosts they apply to are edited.
+        """
+        digest = hashlib.sha1()
+        for section in sorted(self._parser.sections()):
+            if section == "Auth" or section.startswith("Auth."):
+                digest.update(repr((section,
+                                    sorted(self._parser.items(section)))))
+        return digest.hexdigest()
+
     def _get_options(self, auth_section):
         """
         Given a specific section name, returns a kwargs dict
         which can directly be used in the paramiko.SSHClient.connect
         method
         """
+        if auth_section not in self._options_cache:
+            self._options_cache[auth_section] = \
+                self._load_options(auth_section)
+
+        return dict(self._options_cache[auth_section])
+
+    def _load_options(self, auth_section):
         options = dict(self._parser.items(auth_section))
         if set(options) != set(["username", "password"]) and \
            set(options) != set(["key", "username"]) and \
@@ -39,37 +155,73 @@ class AuthManager(object):
         if "key" in options:
             path = options.pop("key")
             path = os.path.expanduser(path)
-            pkey = paramiko.RSAKey.from_private_key_file(path)
+            pkey = load_private_key(path, options.get("password"))
             options["pkey"] = pkey
 
         return options
 
     def get_params(self, hostname, device_type):
+        """
+        Returns the kwargs of the first credential set of a host.
+        """
+        return self.get_credentials(hostname, device_type)[0][1]
+
+    def get_credentials(self, hostname, device_type):
+        """
+        Returns the credential sets to try, in order, for a host. A section
+        may list other sections with a 'credentials' option, such as
+        'credentials = site_2015, site_2014', when the credentials of a site
+        are being rotated.
+
+        :return: The name and the connect kwargs of each credential set
+        :rtype: [(str, dict)]
+        """
+        section_name = self._find_section(hostname, device_type)
+        if not self._parser.has_option(section_name, "credentials"):
+            return [(section_name[len("Auth."):],
+                     self._get_options(section_name))]
+
+        names = self._parser.get(section_name, "credentials").split(",")
+        names = [n.strip() for n in names if n.strip()]
+        if not names:
+            raise AuthConfigError(
+                "No credentials listed in auth section %s" % section_name)
+
+        credentials = []
+        for name in names:
+            try:
+                credentials.append((name, self._get_options("Auth." + name)))
+            except ConfigParser.NoSectionError:
+                raise AuthConfigError(
+                    "Auth section %s does not exist" % name)
+
+        return credentials
+
+    def _find_section(self, hostname, device_type):
+        # Option names are lowercased by the parser
+        # fnmatch.fnmatch() is case-sensitive
+        hostname = hostname.lower()
+
         # Find by hostname
-        for pattern, section_name in self._parser.items("Auth"):
-            # Option names are lowercased by the parser
-            # fnmatch.fnmatch() is case-sensitive
-            hostname = hostname.lower()
-            if not fnmatch.fnmatch(hostname, pattern):
-                continue
+        if self._host_matcher is None:
+            self._host_matcher = HostPatternMatcher(self._parser.items("Auth"))
 
+        section_name = self._host_matcher.match(hostname)
+        if section_name is not None:
             if section_name == "":
                 raise NoAuthRequested("No auth requested for %s" % hostname)
 
             full_section_name = "Auth.%s" % section_name
-            try:
-                return self._get_options(full_section_name)
-            except ConfigParser.NoSectionError:
+            if not self._parser.has_section(full_section_name):
                 raise AuthConfigError(
                     "Auth section %s does not exist" % section_name)
+            return full_section_name
 
         # Find by device, or fallback to defaults if defined
         full_section_name = "Auth.%s" % device_type
         for attempt in (full_section_name, "Auth.default"):
-            try:
-                return self._get_options(full_section_name)
-            except ConfigParser.NoSectionError:
-                continue
+            if self._parser.has_section(attempt):
+                return attempt
 
         raise AuthConfigError(
             "No Auth method provided for host {} ({})".format(hostname,
@@ -89,6 +241,7 @@ HOSTNAME_CUSTOM = hostname_custom
 hostname_unknownopt = hostname_unknownopt
 hostname_missingsection = hostname_missingsection
 mygroup* = mygroup
+rotated* = rotated
 
 [Auth.hostname_custom]
 username = admin_hostname_custom
@@ -113,6 +266,9 @@ password = password_hp
 
 [Auth.juniper]
 username = admin_juniper
+
+[Auth.rotated]
+credentials = mygroup, hp
 """
 
         example = StringIO.StringIO(example)
@@ -141,6 +297,35 @@ username = admin_juniper
             "password": "password_mygroup"}
         self.assertEqual(params, expected)
 
+    def test_first_match_wins(self):
+        matcher = HostPatternMatcher([("core*", "a"),
+                                      ("core-1", "b"),
+                                      ("*-1", "c"),
+                                      ("edge-?", "d"),
+                                      ("edge-1", "e"),
+                                      ("[0-9]*", "f")])
+        self.assertEqual(matcher.match("core-1"), "a")
+        self.assertEqual(matcher.match("edge-1"), "c")
+        self.assertEqual(matcher.match("edge-2"), "d")
+        self.assertEqual(matcher.match("10.0.0.1"), "f")
+        self.assertEqual(matcher.match("unknown"), None)
+
+    def test_credentials_in_order(self):
+        credentials = self.auth_manager.get_credentials("rotated1", "linux")
+        self.assertEqual([name for name, _ in credentials], ["mygroup", "hp"])
+        self.assertEqual(credentials[1][1], {"username": "admin_hp",
+                                             "password": "password_hp"})
+        self.assertEqual(self.auth_manager.get_params("rotated1", "linux"),
+                         credentials[0][1])
+
+    def test_digest_follows_the_auth_sections(self):
+        digest = self.auth_manager.get_digest()
+        self.assertEqual(AuthManager(self.auth_manager._parser).get_digest(),
+                         digest)
+
+        self.auth_manager._parser.set("Auth.hp", "password", "rotated")
+        self.assertNotEqual(self.auth_manager.get_digest(), digest)
+
     def test_by_type_and_password(self):
         params = self.auth_manager.get_params(
             "unknown", "hp")
@@ -163,6 +348,16 @@ username = admin_juniper
         os.unlink("/tmp/test-key")
         os.unlink("/tmp/test-key.pub")
 
+    def test_key_loaded_once(self):
+        k = paramiko.ECDSAKey.generate()
+        k.write_private_key_file("/tmp/test-key")
+        first = self.auth_manager.get_params("unknown", "linux")
+        os.unlink("/tmp/test-key")
+        second = self.auth_manager.get_params("other", "linux")
+        self.assertEqual(first["pkey"], k)
+        self.assertIs(first["pkey"], second["pkey"])
+        self.assertIsNot(first, second)
+
     def test_username_without_password(self):
         with self.assertRaises(AuthConfigError):
             params = self.auth_manager.get_params(
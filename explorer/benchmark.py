@@ -0,0 +1,614 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the exploration machinery, using simulated devices so that
+no network is required.
+
+    python explorer/benchmark.py engines --sizes 100 1000 5000
+    python explorer/benchmark.py auth --hosts 10000
+    python explorer/benchmark.py auth-rules --rules 10 100 1000 5000
+    python explorer/benchmark.py scheduler --topology devices.json
+    python explorer/benchmark.py serializer --devices 3000
+    python explorer/benchmark.py objects --ports 200 --vlans 100
+    python explorer/benchmark.py analysis --distributions 30 --edges 10
+    python explorer/benchmark.py topology --distributions 30 --edges 10
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import fnmatch
+import argparse
+import tempfile
+import StringIO
+import ConfigParser
+
+import paramiko
+
+from auth_manager import AuthManager, HostPatternMatcher
+
+from crawler import Crawler, create_pool, dumps, loads
+from analysis import analyze_vlans
+from topology import Topology
+from network_explorer import ExplorationResult
+from output_parser import HPNetworkOutputParser
+from network_objects import Device, Interface, Trunk, Vlan, \
+    VirtualMachine, VlanMode, VlanStatus
+import serializer
+from scheduler import CrawlScheduler
+
+# Settings of the simulated network, set in every worker by the initializer
+_simulation = {}
+
+
+def _init_simulation(nb_devices, fanout, latency):
+    _simulation.update(nb_devices=nb_devices, fanout=fanout, latency=latency)
+
+
+def _simulated_device(index):
+    return Device(mac_address="sim %d" % index,
+                  system_name="sim%d" % index,
+                  system_description="ProCurve Simulated Switch",
+                  enabled_capabilities="bridge")
+
+
+def _simulated_job(payload):
+    """
+    Explores a simulated device. The devices form a tree where each device
+    also reports its parent, and answering takes 'latency' seconds.
+    """
+    device = loads(payload)
+    index = int(device.system_name[3:])
+
+    time.sleep(_simulation["latency"])
+
+    result = ExplorationResult(_simulated_device(index))
+
+    fanout = _simulation["fanout"]
+    first_child = index * fanout + 1
+    for child in range(first_child, first_child + fanout):
+        if child < _simulation["nb_devices"]:
+            result.neighbors.append(_simulated_device(child))
+    if index > 0:
+        result.neighbors.append(_simulated_device((index - 1) // fanout))
+
+    return dumps(result)
+
+
+def _replayed_job(payload):
+    """
+    Explores a device of a recorded topology, which takes 'latency' seconds,
+    or 'host_latency' seconds for Linux hosts.
+    """
+    device = loads(payload)
+    devices = _simulation["devices"]
+    mac_address = device.mac_address or _simulation["names"][device.system_name]
+
+    if devices[mac_address].type == "linux":
+        time.sleep(_simulation["host_latency"])
+    else:
+        time.sleep(_simulation["latency"])
+
+    result = ExplorationResult(_copy_device(devices[mac_address]))
+    for neighbor in _simulation["links"][mac_address]:
+        result.neighbors.append(_copy_device(devices[neighbor]))
+
+    return dumps(result)
+
+
+def _copy_device(device):
+    return Device(mac_address=device.mac_address,
+                  system_name=device.system_name,
+                  system_description=device.system_description,
+                  enabled_capabilities=device.enabled_capabilities)
+
+
+def _init_replay(devices, links, latency, host_latency):
+    names = dict((d.system_name, m) for m, d in devices.items())
+    _simulation.update(devices=devices, links=links, names=names,
+                       latency=latency, host_latency=host_latency)
+
+
+def _load_topology(path):
+    """
+    Loads the devices and the links of a file written by main.py.
+    """
+    with open(path) as _file:
+        records = json.load(_file)["devices"]
+
+    devices = {}
+    links = {}
+    for record in records:
+        mac_address = record.get("mac_address")
+        if not mac_address:
+            continue
+        devices[mac_address] = Device(
+            mac_address=mac_address,
+            system_name=record.get("system_name"),
+            system_description=record.get("system_description"),
+            enabled_capabilities=record.get("enabled_capabilities"))
+        links[mac_address] = [i.get("remote_mac_address")
+                              for i in record.get("interfaces", {}).values()]
+
+    for mac_address in links:
+        links[mac_address] = [m for m in links[mac_address] if m in devices]
+
+    return devices, links
+
+
+def _generate_topology(nb_cores, nb_distributions, nb_edges, nb_hosts):
+    """
+    Generates a campus network: meshed core switches, distribution switches
+    linked to two cores, with hypervisors and edge switches below them, and
+    more hypervisors below the edge switches.
+    """
+    devices = {}
+    links = {}
+
+    def add(name, description):
+        mac_address = "%012x" % len(devices)
+        devices[mac_address] = Device(mac_address=mac_address,
+                                      system_name=name,
+                                      system_description=description,
+                                      enabled_capabilities="bridge")
+        links[mac_address] = []
+        return mac_address
+
+    def link(a, b):
+        links[a].append(b)
+        links[b].append(a)
+
+    cores = [add("core%d" % i, "Juniper Networks") for i in range(nb_cores)]
+    for i, core in enumerate(cores):
+        for other in cores[:i]:
+            link(core, other)
+
+    for i in range(nb_distributions):
+        distribution = add("dist%d" % i, "HP ProCurve")
+        link(distribution, cores[i % nb_cores])
+        link(distribution, cores[(i + 1) % nb_cores])
+
+        for k in range(nb_hosts):
+            link(add("host%d-%d" % (i, k), "Debian Linux"), distribution)
+
+        for j in range(nb_edges):
+            edge = add("edge%d-%d" % (i, j), "HP ProCurve")
+            link(edge, distribution)
+
+            for k in range(nb_hosts):
+                link(add("host%d-%d-%d" % (i, j, k), "Debian Linux"), edge)
+
+    return devices, links
+
+
+def _crawl_simulated_network(engine, workers, nb_devices, fanout, latency):
+    pool = create_pool(engine, workers, _init_simulation,
+                       (nb_devices, fanout, latency))
+
+    start_time = time.time()
+    crawler = Crawler(pool, _simulated_job)
+    explored_devices = crawler.crawl(_simulated_device(0))
+    elapsed_time = time.time() - start_time
+
+    pool.close()
+    pool.join()
+
+    assert len(explored_devices) == nb_devices
+    return elapsed_time
+
+
+def benchmark_engines(args):
+    print "%-8s %8s %8s %10s %12s" % ("engine", "workers", "devices",
+                                      "seconds", "devices/s")
+
+    for nb_devices in args.sizes:
+        for engine, workers in (("process", args.process_workers),
+                                ("thread", args.thread_workers)):
+            elapsed_time = _crawl_simulated_network(
+                engine, workers, nb_devices, args.fanout, args.latency)
+
+            print "%-8s %8d %8d %10.2f %12.1f" % (
+                engine, workers, nb_devices, elapsed_time,
+                nb_devices / elapsed_time)
+
+
+def benchmark_scheduler(args):
+    if args.topology:
+        devices, links = _load_topology(args.topology)
+    else:
+        devices, links = _generate_topology(4, 8, 8, 4)
+
+    # The crawl starts from the last device, an edge of the network
+    seed = sorted(devices.values(), key=lambda d: d.mac_address)[-1]
+
+    print "%-24s %8s %10s %10s" % ("policy", "devices", "seconds", "90%")
+
+    for policies in args.policies:
+        pool = create_pool("thread", args.workers, _init_replay,
+                           (devices, links, args.latency, args.host_latency))
+
+        scheduler = CrawlScheduler(policies.split(","), args.pinned)
+        crawler = Crawler(pool, _replayed_job, scheduler=scheduler,
+                          max_in_flight=args.workers)
+
+        start_time = time.time()
+        explored_devices = crawler.crawl(Device(system_name=seed.system_name))
+        elapsed_time = time.time() - start_time
+
+        pool.close()
+        pool.join()
+
+        print "%-24s %8d %10.2f %10.2f" % (policies, len(explored_devices),
+                                           elapsed_time,
+                                           crawler.get_discovery_time(0.9))
+
+
+def _generate_devices(nb_devices, nb_interfaces, nb_vlans):
+    """
+    Generates explored switches with tagged VLANs on every interface, and a
+    Linux host with virtual machines every tenth device.
+    """
+    devices = []
+    for i in range(nb_devices):
+        linux = i % 10 == 9
+        device = Device(mac_address="00 00 00 00 %02x %02x" % (i / 256, i % 256),
+                        ip_address="10.0.%d.%d" % (i / 256, i % 256),
+                        ip_address_type="ipv4",
+                        system_name="device%d" % i,
+                        system_description="Debian Linux" if linux
+                        else "HP J9729A 2920-48G Switch",
+                        supported_capabilities="bridge, router",
+                        enabled_capabilities="bridge")
+
+        for port in range(1, nb_interfaces + 1):
+            interface = Interface(local_port=str(port),
+                                  remote_port=str(port),
+                                  remote_mac_address="00 00 00 01 00 %02x" %
+                                  port,
+                                  remote_system_name="neighbor%d" % port)
+            for vlan in range(nb_vlans):
+                interface.add_vlan(Vlan(str(vlan + 1), "VLAN%d" % (vlan + 1),
+                                        VlanMode.TRUNK, VlanStatus.ACTIVE))
+            device.interfaces[str(port)] = interface
+
+        device.trunks["Trk1"] = Trunk("Trk1", "LACP", "1", ["47", "48"])
+        if linux:
+            device.virtual_machines = [VirtualMachine(str(v), "vm%d" % v,
+                                                      "running")
+                                       for v in range(20)]
+        devices.append(device)
+
+    return devices
+
+
+def _measure_encoding(devices, encode):
+    start_time = time.time()
+    size = sum(len(encode(d)) for d in devices)
+    return time.time() - start_time, size
+
+
+def benchmark_serializer(args):
+    devices = _generate_devices(args.devices, args.interfaces, args.vlans)
+
+    encodings = [
+        ("to_JSON before", lambda d: json.dumps(
+            d, default=serializer.to_dict, sort_keys=False, indent=4)),
+        ("compact", serializer.dumps),
+        ("compact+gzip", lambda d: zlib.compress(serializer.dumps(d), 6))]
+    if serializer.msgpack is not None:
+        encodings.append(("msgpack", serializer.dumps_binary))
+
+    print "%-16s %10s %14s" % ("encoding", "seconds", "bytes")
+    for name, encode in encodings:
+        elapsed_time, size = _measure_encoding(devices, encode)
+        print "%-16s %10.2f %14d" % (name, elapsed_time, size)
+
+    if serializer.msgpack is None:
+        print "(msgpack is not installed)"
+
+
+def _get_deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_get_deep_size(k, seen) + _get_deep_size(v, seen)
+                    for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_get_deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_get_deep_size(getattr(obj, a), seen)
+                    for a in obj.__slots__)
+    return size
+
+
+def _parse_core_switch(nb_ports, nb_vlans):
+    """
+    Returns a switch whose VLANs are tagged on every port, as parsed from the
+    output of "show vlans <id>" by the HP parser.
+    """
+    parser = HPNetworkOutputParser()
+    interfaces = dict((str(p), Interface(local_port=str(p)))
+                      for p in range(1, nb_ports + 1))
+
+    header = "  Port Information Mode     Unknown VLAN Status\n" \
+             "  ---------------- -------- ------------ ----------\n"
+    rows = "".join("  %-16s Tagged   Learn        Up\n" % p for p in interfaces)
+    for vlan in range(1, nb_vlans + 1):
+        parser.associate_vlan_to_interfaces(
+            interfaces, Vlan(str(vlan), "VLAN%d" % vlan), header + rows)
+
+    return Device(mac_address="00 00 00 00 00 01", system_name="core",
+                  interfaces=interfaces)
+
+
+def benchmark_objects(args):
+    device = _parse_core_switch(args.ports, args.vlans)
+
+    vlans = [v for i in device.interfaces.itervalues()
+             for v in i.vlans.itervalues()]
+    print "Vlans on the interfaces: %d (%d distinct objects)" % \
+        (len(vlans), len(set(id(v) for v in vlans)))
+    print "Memory of the device:    %d bytes" % _get_deep_size(device, set())
+    print "Pickled device:          %d bytes" % len(dumps(device))
+
+
+def _add_vlan_links(devices, links, nb_vlans, mismatch_ratio):
+    """
+    Adds the interfaces of the links of a generated topology, each carrying
+    the same tagged VLANs on both ends, except on a ratio of the links where
+    one end misses a VLAN.
+    """
+    for mac_address, remote_mac_addresses in links.iteritems():
+        for remote_mac_address in remote_mac_addresses:
+            port = str(len(devices[mac_address].interfaces) + 1)
+            interface = Interface(local_port=port,
+                                  remote_port="?",
+                                  remote_mac_address=remote_mac_address)
+            devices[mac_address].interfaces[port] = interface
+
+            vlans = range(1, nb_vlans + 1)
+            if random.random() < mismatch_ratio / 2:
+                vlans.pop(random.randrange(len(vlans)))
+            for vlan in vlans:
+                interface.add_vlan(Vlan(str(vlan), "VLAN%d" % vlan,
+                                        VlanMode.TRUNK, VlanStatus.ACTIVE))
+
+    # Each interface now tells the local port of its remote end
+    for mac_address, device in devices.iteritems():
+        for interface in device.interfaces.itervalues():
+            remote = devices[interface.remote_mac_address]
+            for remote_interface in remote.interfaces.itervalues():
+                if remote_interface.remote_mac_address == mac_address:
+                    interface.remote_port = remote_interface.local_port
+                    break
+
+
+def benchmark_analysis(args):
+    random.seed(0)
+    devices, links = _generate_topology(args.cores, args.distributions,
+                                        args.edges, args.hosts)
+    _add_vlan_links(devices, links, args.vlans, args.mismatch_ratio)
+
+    start_time = time.time()
+    vlan_analysis = analyze_vlans(Topology(devices))
+    elapsed_time = time.time() - start_time
+
+    print "Analyzed %d devices in %.1f ms: %d mismatched link(s), " \
+        "%d VLAN(s), %d device(s) with orphan VLANs" % \
+        (len(devices), elapsed_time * 1000,
+         len(vlan_analysis["mismatches"]), len(vlan_analysis["reach"]),
+         len(vlan_analysis["orphans"]))
+
+
+def _create_edges_by_scanning(devices):
+    """
+    Builds the edges as 'createEdges' of networkmap.js did, looking up the
+    devices and the edges already built by scanning lists.
+    """
+    device_list = devices.values()
+    edges = []
+    for device in device_list:
+        for interface in device.interfaces.itervalues():
+            link = (device.mac_address, interface.remote_mac_address)
+            remote = next((d for d in device_list
+                           if d.mac_address == link[1]), None)
+            if remote is not None and not any(
+                    e == link or e == link[::-1] for e in edges):
+                edges.append(link)
+    return edges
+
+
+def benchmark_topology(args):
+    devices, links = _generate_topology(args.cores, args.distributions,
+                                        args.edges, args.hosts)
+    _add_vlan_links(devices, links, 0, 0)
+
+    start_time = time.time()
+    edges = Topology(devices).get_edges()
+    elapsed_time = time.time() - start_time
+    print "Topology:         %d edges in %.1f ms" % (len(edges),
+                                                     elapsed_time * 1000)
+
+    start_time = time.time()
+    edges = _create_edges_by_scanning(devices)
+    elapsed_time = time.time() - start_time
+    print "Scanning devices: %d edges in %.1f ms" % (len(edges),
+                                                     elapsed_time * 1000)
+
+
+def _measure_get_params(get_auth_manager, hostnames):
+    start_time = time.time()
+    for hostname in hostnames:
+        get_auth_manager().get_params(hostname, "linux")
+    return time.time() - start_time
+
+
+def benchmark_auth(args):
+    key_path = tempfile.mktemp()
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+
+    config = "[Auth]\n"
+    config += "".join("site%d-* = site%d\n" % (i, i) for i in range(10))
+    config += "".join("[Auth.site%d]\nusername = admin\npassword = pw\n" % i
+                      for i in range(10))
+    config += "[Auth.linux]\nkey = %s\nusername = root\n" % key_path
+
+    parser = ConfigParser.RawConfigParser()
+    parser.readfp(StringIO.StringIO(config))
+
+    hostnames = ["host%d" % i for i in range(args.hosts)]
+
+    try:
+        # Before, every device was explored with its own AuthManager
+        sample = hostnames[:max(len(hostnames) / 100, 1)]
+        elapsed_time = _measure_get_params(lambda: AuthManager(parser),
+                                           sample)
+        uncached = len(sample) / elapsed_time
+
+        auth_manager = AuthManager(parser)
+        auth_manager.preload()
+        elapsed_time = _measure_get_params(lambda: auth_manager, hostnames)
+        cached = len(hostnames) / elapsed_time
+    finally:
+        os.unlink(key_path)
+
+    print "%-10s %14s" % ("keys", "get_params/s")
+    print "%-10s %14.1f" % ("uncached", uncached)
+    print "%-10s %14.1f" % ("cached", cached)
+
+
+def _generate_rules(nb_rules):
+    """
+    Generates rules looking like the ones of a CMDB: mostly exact names and
+    site globs, with a catch-all at the end.
+    """
+    rules = []
+    for i in range(nb_rules - 1):
+        if i % 3 == 0:
+            rules.append(("site%d-*" % i, "site%d" % i))
+        else:
+            rules.append(("host%d.site%d" % (i, i / 3), "host%d" % i))
+    rules.append(("*", "default"))
+    return rules
+
+
+def benchmark_auth_rules(args):
+    print "%8s %16s %16s" % ("rules", "fnmatch/s", "compiled/s")
+
+    for nb_rules in args.rules:
+        rules = _generate_rules(nb_rules)
+        names = ["site%d-sw%d" % (i, i) for i in range(0, nb_rules, 7)] + \
+                ["unknown%d" % i for i in range(100)]
+
+        # The linear scan is measured on a sample, since it is very slow
+        sample = names[:20]
+        start_time = time.time()
+        for name in sample:
+            for pattern, value in rules:
+                if fnmatch.fnmatch(name, pattern):
+                    break
+        linear = len(sample) / (time.time() - start_time)
+
+        matcher = HostPatternMatcher(rules)
+        start_time = time.time()
+        for _ in range(10):
+            for name in names:
+                matcher.match(name)
+        compiled = len(names) * 10 / (time.time() - start_time)
+
+        print "%8d %16.1f %16.1f" % (nb_rules, linear, compiled)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the network exploration.")
+    subparsers = parser.add_subparsers()
+
+    engines = subparsers.add_parser(
+        "engines", help="Compare the process and thread engines.")
+    engines.add_argument("--sizes", type=int, nargs="+",
+                         default=[100, 1000, 5000])
+    engines.add_argument("--latency", type=float, default=0.5,
+                         help="Seconds spent waiting on each device.")
+    engines.add_argument("--fanout", type=int, default=8)
+    engines.add_argument("--process-workers", type=int, default=10)
+    engines.add_argument("--thread-workers", type=int, default=200)
+    engines.set_defaults(func=benchmark_engines)
+
+    auth = subparsers.add_parser(
+        "auth", help="Measure the throughput of AuthManager.get_params().")
+    auth.add_argument("--hosts", type=int, default=10000)
+    auth.set_defaults(func=benchmark_auth)
+
+    auth_rules = subparsers.add_parser(
+        "auth-rules", help="Measure the lookup of hosts in the [Auth] rules.")
+    auth_rules.add_argument("--rules", type=int, nargs="+",
+                            default=[10, 100, 1000, 5000])
+    auth_rules.set_defaults(func=benchmark_auth_rules)
+
+    scheduler = subparsers.add_parser(
+        "scheduler", help="Compare the scheduling policies of the crawl.")
+    scheduler.add_argument("--topology",
+                           help="A file written by main.py to replay, "
+                                "instead of a generated network.")
+    scheduler.add_argument("--policies", nargs="+",
+                           default=["fifo", "depth", "degree",
+                                    "vendor,degree", "vendor,depth"])
+    scheduler.add_argument("--pinned", nargs="*", default=[])
+    scheduler.add_argument("--latency", type=float, default=0.05,
+                           help="Seconds spent waiting on each switch.")
+    scheduler.add_argument("--host-latency", type=float, default=0.2,
+                           help="Seconds spent waiting on each Linux host.")
+    scheduler.add_argument("--workers", type=int, default=10)
+    scheduler.set_defaults(func=benchmark_scheduler)
+
+    serializer_parser = subparsers.add_parser(
+        "serializer", help="Compare the encodings of the explored devices.")
+    serializer_parser.add_argument("--devices", type=int, default=3000)
+    serializer_parser.add_argument("--interfaces", type=int, default=48)
+    serializer_parser.add_argument("--vlans", type=int, default=10)
+    serializer_parser.set_defaults(func=benchmark_serializer)
+
+    objects = subparsers.add_parser(
+        "objects", help="Measure the memory and the pickled size of a "
+                        "switch with many tagged VLANs.")
+    objects.add_argument("--ports", type=int, default=200)
+    objects.add_argument("--vlans", type=int, default=100)
+    objects.set_defaults(func=benchmark_objects)
+
+    analysis = subparsers.add_parser(
+        "analysis", help="Measure the VLAN analysis of a generated network.")
+    analysis.add_argument("--cores", type=int, default=4)
+    analysis.add_argument("--distributions", type=int, default=30)
+    analysis.add_argument("--edges", type=int, default=10)
+    analysis.add_argument("--hosts", type=int, default=8)
+    analysis.add_argument("--vlans", type=int, default=50)
+    analysis.add_argument("--mismatch-ratio", type=float, default=0.05)
+    analysis.set_defaults(func=benchmark_analysis)
+
+    topology = subparsers.add_parser(
+        "topology", help="Compare the building of the edges of a generated "
+                         "network with the former scan of the devices.")
+    topology.add_argument("--cores", type=int, default=4)
+    topology.add_argument("--distributions", type=int, default=30)
+    topology.add_argument("--edges", type=int, default=10)
+    topology.add_argument("--hosts", type=int, default=8)
+    topology.set_defaults(func=benchmark_topology)
+
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+
+from network_objects import DeviceStatus, mac_address_to_bytes
+
+
+class JsonStore(object):
+    """
+    A dict persisted as a JSON file between the runs. The file is replaced
+    atomically when saved, so an interrupted run never corrupts it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+
+        if path and os.path.isfile(path):
+            try:
+                with open(path) as _file:
+                    self.data = json.load(_file)
+            except (IOError, ValueError) as e:
+                logging.warning("Could not load '%s': %s", path, e)
+
+    def save(self):
+        if not self.path:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as _file:
+            json.dump(self.data, _file)
+        os.rename(temp_path, self.path)
+
+
+def _get_keys(device):
+    keys = []
+
+    mac_address = mac_address_to_bytes(device.mac_address)
+    if mac_address is not None:
+        keys.append("mac:" + mac_address.encode("hex"))
+    if device.system_name:
+        keys.append("host:" + device.system_name.lower())
+
+    return keys
+
+
+class NegativeCache(JsonStore):
+    """
+    Remembers the devices which could not be explored, by MAC address and by
+    hostname, so that they are not retried before their entry expires. The
+    authentication failures also expire as soon as the [Auth] sections of
+    the configuration change.
+    """
+
+    def __init__(self, path, ttls, auth_digest=None):
+        """
+        :param path: The file in which the cache is persisted, if any
+        :type path: str
+        :param ttls: The number of seconds an entry is kept, by status
+        :type ttls: {str : float}
+        :param auth_digest: The digest of the authentication configuration,
+                            as given by AuthManager.get_digest()
+        :type auth_digest: str
+        """
+        super(NegativeCache, self).__init__(path)
+        self.ttls = ttls
+        self.auth_digest = auth_digest
+
+    def get(self, device):
+        """
+        Returns the cached failure of a device if it has not expired, as a
+        dict with its 'status' and the 'time' it happened. Returns None
+        otherwise.
+        """
+        now = time.time()
+        for key in _get_keys(device):
+            entry = self.data.get(key)
+            if entry is None:
+                continue
+
+            if entry["status"] in AUTH_STATUSES and \
+               entry.get("auth") != self.auth_digest:
+                continue
+
+            ttl = self.ttls.get(entry["status"], 0)
+            if now - entry["time"] < ttl:
+                return entry
+
+        return None
+
+    def add(self, device, cost=0):
+        """
+        :param device: The device which failed to be explored
+        :type device: Device
+        :param cost: The number of seconds the failed attempt took, which a
+                     later run saves by skipping the device
+        :type cost: float
+        """
+        if self.ttls.get(device.status, 0) <= 0:
+            return
+
+        entry = {"status": device.status, "time": time.time(), "cost": cost}
+        if device.status in AUTH_STATUSES:
+            entry["auth"] = self.auth_digest
+        for key in _get_keys(device):
+            self.data[key] = entry
+
+    def remove(self, device):
+        for key in _get_keys(device):
+            self.data.pop(key, None)
+
+
+# A device which requested no authentication is never connected to, so
+# remembering it would save nothing
+NEGATIVE_CACHE_STATUSES = (DeviceStatus.UNREACHABLE,
+                           DeviceStatus.AUTH_FAILED)
+
+# The failures which depend on the authentication configuration
+AUTH_STATUSES = (DeviceStatus.AUTH_FAILED,)
+
+
+def _get_subnet(ip_address):
+    """
+    Returns the /24 subnet of an IPv4 address, such as '10.0.1.0/24'.
+    """
+    parts = (ip_address or "").split(".")
+    if len(parts) != 4 or not all(p.isdigit() for p in parts):
+        return None
+    return ".".join(parts[:3]) + ".0/24"
+
+
+class CredentialMemo(JsonStore):
+    """
+    Remembers which credential set worked for each host, each device type and
+    each subnet, so that it is tried first during the next runs.
+    """
+
+    def _get_keys(self, hostname, device_type, ip_address):
+        # From the most specific to the most general
+        keys = ["host:" + hostname.lower()]
+        subnet = _get_subnet(ip_address)
+        if subnet is not None:
+            keys.append("subnet:" + subnet)
+        if device_type:
+            keys.append("type:" + device_type)
+        return keys
+
+    def record(self, hostname, device_type, ip_address, name):
+        """
+        :param name: The name of the credential set which worked
+        :type name: str
+        """
+        for key in self._get_keys(hostname, device_type, ip_address):
+            self.data[key] = name
+
+    def sort(self, credentials, hostname, device_type, ip_address):
+        """
+        Moves the credential set which worked last for the host, or else for
+        its subnet or its device type, in front of the others.
+
+        :param credentials: The name and the kwargs of each credential set
+        :type credentials: [(str, dict)]
+        :rtype: [(str, dict)]
+        """
+        names = [name for name, _ in credentials]
+        for key in self._get_keys(hostname, device_type, ip_address):
+            name = self.data.get(key)
+            if name in names:
+                index = names.index(name)
+                return [credentials[index]] + \
+                    credentials[:index] + credentials[index + 1:]
+
+        return credentials
+
+
+class VendorMemo(JsonStore):
+    """
+    Remembers the type of each explored host, so that the devices which are
+    not described by any neighbor (such as the first one) can be prepared
+    before their banner is received.
+    """
+
+    def get(self, hostname):
+        return self.data.get(hostname.lower())
+
+    def record(self, hostname, device_type):
+        self.data[hostname.lower()] = device_type
+
+
+import unittest
+from network_objects import Device
+
+
+class NegativeCacheTester(unittest.TestCase):
+    def setUp(self):
+        self.cache = NegativeCache(None, {DeviceStatus.UNREACHABLE: 60,
+                                          DeviceStatus.AUTH_FAILED: 60},
+                                   auth_digest="1")
+
+    def _device(self, status):
+        return Device(mac_address="00 1f fe 83 89 00", system_name="SW1",
+                      status=status)
+
+    def test_by_mac_address_and_hostname(self):
+        self.cache.add(self._device(DeviceStatus.UNREACHABLE))
+        self.assertEqual(self.cache.get(Device(system_name="sw1"))["status"],
+                         DeviceStatus.UNREACHABLE)
+        self.assertIsNotNone(self.cache.get(Device(
+            mac_address="00:1f:fe:83:89:00")))
+
+        self.cache.remove(self._device(None))
+        self.assertIsNone(self.cache.get(self._device(None)))
+
+    def test_expiration(self):
+        self.cache.add(self._device(DeviceStatus.UNREACHABLE))
+        for entry in self.cache.data.values():
+            entry["time"] -= 61
+        self.assertIsNone(self.cache.get(self._device(None)))
+
+    def test_statuses_without_ttl(self):
+        self.cache.add(self._device(DeviceStatus.NO_AUTH_REQUESTED))
+        self.assertEqual(self.cache.data, {})
+
+    def test_auth_failures_expire_with_the_auth_config(self):
+        self.cache.add(self._device(DeviceStatus.AUTH_FAILED))
+        self.assertIsNotNone(self.cache.get(self._device(None)))
+
+        self.cache.auth_digest = "2"
+        self.assertIsNone(self.cache.get(self._device(None)))
+
+
+class CredentialMemoTester(unittest.TestCase):
+    def setUp(self):
+        self.credentials = [("a", {}), ("b", {}), ("c", {})]
+        self.memo = CredentialMemo(None)
+
+    def _sort(self, hostname, device_type, ip_address):
+        return [name for name, _ in self.memo.sort(
+            self.credentials, hostname, device_type, ip_address)]
+
+    def test_unknown(self):
+        self.assertEqual(self._sort("sw1", "hp", "10.0.1.1"), ["a", "b", "c"])
+
+    def test_host_then_subnet_then_type(self):
+        self.memo.record("SW1", "hp", "10.0.1.1", "c")
+        self.memo.record("sw2", "hp", "10.0.2.1", "b")
+
+        self.assertEqual(self._sort("sw1", "juniper", None), ["c", "a", "b"])
+        self.assertEqual(self._sort("sw3", "juniper", "10.0.1.9"),
+                         ["c", "a", "b"])
+        self.assertEqual(self._sort("sw3", "hp", "10.0.3.1"), ["b", "a", "c"])
+
+    def test_unknown_name(self):
+        self.memo.record("sw1", "hp", None, "removed")
+        self.assertEqual(self._sort("sw1", "hp", None), ["a", "b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
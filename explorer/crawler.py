@@ -0,0 +1,770 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import Queue
+import cPickle
+import logging
+import itertools
+import threading
+
+from multiprocessing import Pool, RawArray, RawValue
+from multiprocessing.pool import ThreadPool
+
+from cache import NEGATIVE_CACHE_STATUSES
+from metrics import merge_histograms
+from scheduler import CrawlScheduler
+from network_objects import DeviceStatus, mac_address_to_bytes
+
+ENGINES = ("process", "thread")
+
+# Number of MAC addresses which the crawler can share with the workers
+MAX_SHARED_MAC_ADDRESSES = 1 << 18
+
+# The longest wait for a result, in seconds. Waiting on a queue without a
+# timeout cannot be interrupted by Ctrl-C with Python 2.
+MAX_WAIT_TIME = 1.0
+
+
+def create_pool(engine, workers, initializer=None, initargs=()):
+    """
+    Creates the pool of workers used to explore the devices.
+
+    The 'process' engine explores each device in a worker process, while the
+    'thread' engine runs every worker as a thread of the current process.
+    Since exploring a device mostly means waiting for its answers, a single
+    process can drive hundreds of sessions with the 'thread' engine.
+
+    :param engine: The name of the engine, one of ENGINES
+    :type engine: str
+    :param workers: The number of workers in the pool
+    :type workers: int
+    """
+    if engine == "thread":
+        return ThreadPool(workers, initializer, initargs)
+    elif engine == "process":
+        return Pool(workers, initializer, initargs)
+
+    raise ValueError("Unknown engine '%s'" % engine)
+
+
+def dumps(obj):
+    return cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+
+
+def loads(payload):
+    return cPickle.loads(payload)
+
+
+def _run_job(job, payload):
+    """
+    Runs a job inside a worker. The pools of Python 2.7 have no error
+    callback, so a job which raised would never send anything back and the
+    crawler would wait for it forever: None is sent back instead.
+    """
+    try:
+        return job(payload)
+    except Exception as e:
+        logging.exception("Job failed: %s", e)
+        return None
+
+
+class KnownMacAddresses(object):
+    """
+    The MAC addresses of the devices known by the crawler, shared with the
+    workers through shared memory. The crawler appends each address once,
+    packed as 6 bytes, and each worker only reads the addresses added since
+    its previous job, instead of receiving all of them with every job.
+
+    It must be created before the pool, so that the worker processes
+    inherit the shared memory. The addresses past its capacity are not
+    shared with the workers.
+    """
+
+    def __init__(self, capacity=MAX_SHARED_MAC_ADDRESSES):
+        self.capacity = capacity
+        self._buffer = RawArray("c", capacity * 6)
+        self._count = RawValue("i", 0)
+
+        # Addresses read so far by the workers of the current process
+        self._known = set()
+        self._nb_read = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count.value
+
+    def add(self, mac_address):
+        """
+        Shares the 6 bytes of a MAC address, from the crawler.
+        """
+        index = self._count.value
+        if index < self.capacity:
+            self._buffer[index * 6:index * 6 + 6] = mac_address
+            # The address is written before it is counted
+            self._count.value = index + 1
+
+    def get(self):
+        """
+        Returns every MAC address shared so far, from a worker.
+
+        :rtype: set
+        """
+        with self._lock:
+            count = self._count.value
+            if count > self._nb_read:
+                packed = self._buffer[self._nb_read * 6:count * 6]
+                self._known.update(packed[i:i + 6]
+                                   for i in range(0, len(packed), 6))
+                self._nb_read = count
+            return self._known
+
+
+class Crawler(object):
+    """
+    Coordinates the exploration of the network. Discovered devices wait in a
+    scheduler which decides which one is handed next to the pool of workers,
+    and the crawler blocks until a worker sends back the result of its job.
+
+    The crawler is the only owner of the explored devices, which makes the
+    deduplication of the neighbors by MAC address free of any race.
+    """
+
+    def __init__(self, pool, job, probe=None, negative_cache=None,
+                 credential_memo=None, vendor_memo=None, scheduler=None,
+                 max_in_flight=None, throttle=None, job_timeout=None,
+                 sink=None, known_mac_addresses=None, probe_timeout=0):
+        """
+        :param pool: The pool of workers exploring the devices
+        :type pool: multiprocessing.Pool
+        :param job: The function exploring a device inside a worker. It is
+                    called with a pickled Device and must return a pickled
+                    ExplorationResult.
+        :type job: function
+        :param probe: The function checking which devices are reachable
+                      before they are explored, such as probe_hosts(). It is
+                      called from a helper thread with a list of hostnames
+                      and must return whether each one is reachable, by
+                      hostname.
+        :type probe: function
+        :param negative_cache: The devices which recently failed to be
+                               explored, which are not tried again
+        :type negative_cache: NegativeCache
+        :param credential_memo: Where the credential set which worked for
+                                each device is recorded
+        :type credential_memo: CredentialMemo
+        :param vendor_memo: Where the type of each device is recorded
+        :type vendor_memo: VendorMemo
+        :param scheduler: Decides in which order the devices are explored,
+                          first discovered first by default
+        :type scheduler: CrawlScheduler
+        :param max_in_flight: The number of devices handed to the pool at
+                              the same time, usually its number of workers.
+                              Devices are handed as soon as they are
+                              discovered when None.
+        :type max_in_flight: int
+        :param throttle: Limits the sessions of each group of devices
+        :type throttle: Throttle
+        :param job_timeout: The number of seconds after which a job is
+                            abandoned if its result did not come back
+        :type job_timeout: float
+        :param sink: Where each device is written once it is done
+        :type sink: ResultSink
+        :param known_mac_addresses: Where the MAC addresses of the known
+                                    devices are shared with the workers, so
+                                    that they skip the details of these
+                                    devices
+        :type known_mac_addresses: KnownMacAddresses
+        :param probe_timeout: The number of seconds the probe waits for each
+                              device, which is what an unreachable device
+                              costs
+        :type probe_timeout: float
+        """
+        self._pool = pool
+        self._job = job
+        self._probe = probe
+        self._negative_cache = negative_cache
+        self._credential_memo = credential_memo
+        self._vendor_memo = vendor_memo
+        self._scheduler = scheduler
+        if scheduler is None:
+            self._scheduler = CrawlScheduler()
+        self._max_in_flight = max_in_flight
+        self._throttle = throttle
+        self._job_timeout = job_timeout
+        self._sink = sink
+        self._known_mac_addresses = known_mac_addresses
+        self._probe_timeout = probe_timeout
+        self._results = Queue.Queue()
+
+        # Device and deadline of the running jobs, by job identifier
+        self._running = {}
+        self._job_ids = itertools.count()
+
+        # Device of the abandoned jobs whose worker did not return yet, with
+        # the time after which the worker is deemed lost, by job identifier
+        self._abandoned = {}
+
+        # Devices and depth of the running probes, by job identifier
+        self._probes = {}
+
+        # The devices not allowed by the throttle yet are held by the
+        # scheduler under the name of their group. The time at which each
+        # group may allow a new device, by name, and the time since
+        # which each device is held, by device identity
+        self._resume_times = {}
+        self._held_since = {}
+
+        self._pending = 0
+
+        self.explored_devices = {}
+
+        # Number of hops from the seed, by MAC address
+        self._depths = {}
+
+        # Number of seconds after the start at which each device was found
+        self._start_time = None
+        self.discovery_times = []
+
+        # MAC address of each known device as written by the devices, by
+        # its 6 bytes
+        self._chassis = {}
+
+        self.ipc_bytes = 0
+        self.nb_jobs = 0
+        self.commands_saved = 0
+        self.command_latencies = {}
+        self.nb_unreachable = 0
+        self.attempts_avoided = 0
+        self.time_saved = 0
+        self.nb_timed_out = 0
+
+    def crawl(self, seed):
+        """
+        Explores the network starting from the given device and returns once
+        every discovered device has been explored.
+
+        :param seed: The first device to explore
+        :type seed: Device
+        :return: The explored devices, by MAC address
+        :rtype: {str : Device}
+        """
+        self._start_time = time.time()
+        # The seed is always explored, whatever happened during the
+        # previous runs
+        self._dispatch_all([seed], 0, use_negative_cache=False)
+        retry_delay = self._fill()
+
+        while self._pending > 0 or self._scheduler.nb_held or self._probes:
+            try:
+                job_id, payload = self._results.get(
+                    timeout=self._get_wait_time(retry_delay))
+            except Queue.Empty:
+                self._abandon_overdue_jobs()
+                retry_delay = self._fill()
+                continue
+
+            if job_id in self._probes:
+                self._handle_probe(job_id, payload)
+            elif job_id in self._running:
+                device = self._end_job(job_id)
+                if payload is None:
+                    logging.error("[%s] Exploration failed",
+                                  device.system_name)
+                    self._finish(device)
+                else:
+                    self.ipc_bytes += len(payload)
+                    self._handle_result(loads(payload))
+            elif job_id in self._abandoned:
+                # The result of an abandoned job is ignored, but its worker
+                # is now done with the session
+                self._release_abandoned_job(job_id)
+            else:
+                continue
+
+            self._abandon_overdue_jobs()
+            retry_delay = self._fill()
+
+        return self.explored_devices
+
+    def _get_wait_time(self, retry_delay):
+        """
+        Returns how long to wait for a result, without missing the retry of
+        a held device nor the deadline of a job. The wait is always finite
+        so that the crawl can be interrupted.
+        """
+        wait_time = MAX_WAIT_TIME
+        if retry_delay is not None:
+            wait_time = min(wait_time, retry_delay)
+
+        if self._job_timeout is not None and (self._running or
+                                              self._abandoned):
+            deadline = min(d for _, d in self._running.values() +
+                           self._abandoned.values())
+            wait_time = min(wait_time, max(deadline - time.time(), 0))
+        return wait_time
+
+    def _abandon_overdue_jobs(self):
+        """
+        Gives up on the jobs which did not come back before their deadline,
+        so that a hung session cannot keep the crawl running forever.
+
+        The worker of an abandoned job may still hold its session, which
+        stays counted by the throttle until the worker returns, or until it
+        is deemed lost after another job timeout.
+        """
+        if self._job_timeout is None:
+            return
+
+        now = time.time()
+        for job_id, (device, deadline) in self._running.items():
+            if now < deadline:
+                continue
+
+            logging.error("[%s] No result after %ss, abandoned",
+                          device.system_name, self._job_timeout)
+            device.status = DeviceStatus.TIMED_OUT
+            self.nb_timed_out += 1
+            del self._running[job_id]
+            self._pending -= 1
+            self._abandoned[job_id] = (device, now + self._job_timeout)
+            self._finish(device)
+
+        for job_id, (device, deadline) in self._abandoned.items():
+            if now >= deadline:
+                logging.error("[%s] Worker lost, its session is freed",
+                              device.system_name)
+                self._release_abandoned_job(job_id)
+
+    def _end_job(self, job_id):
+        device, _ = self._running.pop(job_id)
+        self._pending -= 1
+        self._release_session(device)
+        return device
+
+    def _release_abandoned_job(self, job_id):
+        device, _ = self._abandoned.pop(job_id)
+        self._release_session(device)
+
+    def _release_session(self, device):
+        """
+        Ends the session of a device in its throttle group. The first device
+        held for the group is scheduled again by the next fill, once the
+        result of the job has updated the priorities.
+        """
+        if self._throttle is None:
+            return
+
+        self._throttle.release(device)
+        group = self._throttle.get_group(device)
+        if group is not None:
+            self._resume_times[group.name] = 0
+
+    def get_discovery_time(self, fraction):
+        """
+        Returns the number of seconds it took to find the given fraction of
+        the devices, such as 0.9 for 90% of them.
+        """
+        if not self.discovery_times:
+            return None
+
+        times = sorted(self.discovery_times)
+        index = max(int(round(fraction * len(times))) - 1, 0)
+        return times[index]
+
+    def _handle_result(self, result):
+        merge_histograms(self.command_latencies, result.command_latencies)
+        self.commands_saved += result.commands_saved
+
+        device = result.device
+        if device.mac_address:
+            self._add_device(device)
+            self._finish(device)
+
+        if self._negative_cache is not None:
+            if device.status in NEGATIVE_CACHE_STATUSES:
+                self._negative_cache.add(device, result.duration)
+            else:
+                self._negative_cache.remove(device)
+
+        if self._credential_memo is not None and result.credentials:
+            self._credential_memo.record(result.hostname, device.type,
+                                         device.ip_address, result.credentials)
+
+        if self._vendor_memo is not None and device.type is not None and \
+           result.hostname:
+            self._vendor_memo.record(result.hostname, device.type)
+
+        depth = self._depths.get(device.mac_address, 0)
+
+        # The explorer does not send back the neighbors which were already
+        # known, so they are found on the interfaces of the device
+        reported = set()
+        for interface in device.interfaces.itervalues():
+            mac_address = self._chassis.get(
+                mac_address_to_bytes(interface.remote_mac_address))
+            if mac_address is not None and mac_address not in reported:
+                reported.add(mac_address)
+                self._scheduler.report(self.explored_devices[mac_address])
+
+        new_devices = []
+        for neighbor in result.neighbors:
+            if neighbor.mac_address not in self.explored_devices:
+                self._add_device(neighbor)
+                new_devices.append(neighbor)
+            elif neighbor.mac_address not in reported:
+                reported.add(neighbor.mac_address)
+                self._scheduler.report(neighbor)
+
+        self._dispatch_all(new_devices, depth + 1)
+
+        logging.debug("[%s] Exploration done (%d pending)",
+                      device.system_name, self._pending)
+
+    def _add_device(self, device):
+        if device.mac_address not in self.explored_devices:
+            mac_address = mac_address_to_bytes(device.mac_address)
+            if mac_address is not None:
+                if self._known_mac_addresses is not None:
+                    self._known_mac_addresses.add(mac_address)
+                self._chassis[mac_address] = device.mac_address
+            self.discovery_times.append(time.time() - self._start_time)
+
+        self.explored_devices[device.mac_address] = device
+
+    def _finish(self, device):
+        """
+        Hands a device which will not change anymore to the sink.
+        """
+        if self._sink is not None and \
+           device.mac_address in self.explored_devices:
+            self._sink.write(device)
+
+    def _dispatch_all(self, devices, depth, use_negative_cache=True):
+        """
+        Schedules a batch of new devices, leaving aside the devices which do
+        not accept connections, without waiting for any SSH handshake. The
+        devices are probed by a helper thread while the crawler goes on with
+        the results of the jobs, and are scheduled once the probe is back.
+
+        :param depth: The number of hops between the devices and the seed
+        :type depth: int
+        :param use_negative_cache: Whether the devices which failed during the
+                                   previous runs are left aside
+        :type use_negative_cache: bool
+        """
+        if self._negative_cache is not None and use_negative_cache:
+            devices = [d for d in devices if not self._is_known_bad(d)]
+
+        if self._probe is None:
+            self._schedule(devices, depth)
+        elif devices:
+            probe_id = next(self._job_ids)
+            self._probes[probe_id] = (devices, depth)
+
+            thread = threading.Thread(
+                target=self._run_probe,
+                args=(probe_id, [d.system_name for d in devices]))
+            thread.daemon = True
+            thread.start()
+
+    def _run_probe(self, probe_id, hostnames):
+        """
+        Probes hosts from a helper thread, then hands the result to the
+        crawler through the queue of the results of the jobs. The hosts are
+        deemed reachable if the probe itself fails.
+        """
+        try:
+            reachable = self._probe(hostnames)
+        except Exception as e:
+            logging.exception("Probe failed: %s", e)
+            reachable = dict.fromkeys(hostnames, True)
+
+        self._results.put((probe_id, reachable))
+
+    def _handle_probe(self, probe_id, reachable):
+        devices, depth = self._probes.pop(probe_id)
+
+        for device in devices:
+            if not reachable.get(device.system_name):
+                logging.info("[%s] Unreachable, not explored",
+                             device.system_name)
+                device.status = DeviceStatus.UNREACHABLE
+                self.nb_unreachable += 1
+                if self._negative_cache is not None:
+                    self._negative_cache.add(device, self._probe_timeout)
+                self._finish(device)
+
+        self._schedule([d for d in devices if reachable.get(d.system_name)],
+                       depth)
+
+    def _schedule(self, devices, depth):
+        for device in devices:
+            self._depths[device.mac_address] = depth
+            self._scheduler.push(device, depth)
+
+    def _fill(self):
+        """
+        Hands the next scheduled devices to the pool, until it is busy. The
+        devices which are not allowed by the throttle yet are held by the
+        scheduler, with their priority, until their group may allow them.
+
+        :return: The number of seconds after which a held device may be
+                 allowed, or None to wait for the end of a job
+        :rtype: float
+        """
+        now = time.time()
+        for name, resume_time in self._resume_times.items():
+            if resume_time <= now:
+                del self._resume_times[name]
+                self._scheduler.resume(name)
+
+        while (self._max_in_flight is None or
+               self._pending < self._max_in_flight) and \
+                len(self._scheduler) > 0:
+            device = self._scheduler.pop()
+
+            delay, group = 0, None
+            if self._throttle is not None:
+                delay = self._throttle.acquire(device, now)
+                group = self._throttle.get_group(device)
+
+            if delay == 0:
+                since = self._held_since.pop(id(device), None)
+                if since is not None:
+                    group.throttled_time += now - since
+                self._dispatch(device)
+
+                # The group may allow another one of its held devices
+                if group is not None:
+                    self._scheduler.resume(group.name)
+            else:
+                self._held_since.setdefault(id(device), now)
+                self._scheduler.hold(device, group.name)
+                if delay is not None:
+                    self._resume_times[group.name] = min(
+                        self._resume_times.get(group.name, now + delay),
+                        now + delay)
+
+        if not self._resume_times:
+            return None
+        return max(min(self._resume_times.values()) - now, 0)
+
+    def _is_known_bad(self, device):
+        entry = self._negative_cache.get(device)
+        if entry is None:
+            return False
+
+        logging.info("[%s] %s during a previous run, not explored",
+                     device.system_name, entry["status"])
+        device.status = entry["status"]
+        self.attempts_avoided += 1
+        self.time_saved += entry.get("cost", 0)
+        self._finish(device)
+        return True
+
+    def _dispatch(self, device):
+        payload = dumps(device)
+        self.ipc_bytes += len(payload)
+        self.nb_jobs += 1
+
+        job_id = next(self._job_ids)
+        deadline = None
+        if self._job_timeout is not None:
+            deadline = time.time() + self._job_timeout
+        self._running[job_id] = (device, deadline)
+
+        self._pending += 1
+        self._pool.apply_async(
+            _run_job, (self._job, payload),
+            callback=lambda result: self._results.put((job_id, result)))
+
+
+import unittest
+from cache import NegativeCache
+from throttle import Throttle, ThrottleGroup
+from network_objects import Device
+from network_explorer import ExplorationResult, NetworkExplorer
+
+# Neighbors of each device of the network explored by the tests
+_network = {}
+
+# Names of the devices explored by the tests, in order
+_explored = []
+
+# MAC addresses shared with the simulated explorers
+_known_mac_addresses = KnownMacAddresses(16)
+
+
+def _fake_job(payload):
+    device = loads(payload)
+    if device.system_name == "broken":
+        raise ValueError("broken")
+    if device.system_name == "hung":
+        time.sleep(0.3)
+    _explored.append(device.system_name)
+
+    device.mac_address = device.system_name
+    neighbors = [Device(mac_address=n, system_name=n,
+                        system_description="HP ProCurve",
+                        enabled_capabilities="bridge")
+                 for n in _network.get(device.system_name, [])]
+    return dumps(ExplorationResult(device, neighbors))
+
+
+def _get_mac_address(name):
+    return " ".join("%02x" % ord(c) for c in name.ljust(6)[:6])
+
+
+class _SimulatedExplorer(NetworkExplorer):
+    """
+    Explores the HP switches of the network of the tests through the outputs
+    they would show, without any SSH connection.
+    """
+
+    def _open_ssh_connection(self):
+        pass
+
+    def _close_ssh_connection(self):
+        pass
+
+    def _receive_banner(self):
+        return u"ProCurve J9049A Switch 2900-24G"
+
+    def _prepare_switch(self):
+        pass
+
+    def _prepare_switch_ahead(self):
+        return True, None
+
+    def _send_ssh_command(self, command):
+        if command is None:
+            return None
+
+        neighbors = _network.get(self.hostname, [])
+
+        if command == "show lldp info local-device\n":
+            return u"  Chassis Id : %s\n  System Name : %s\n" % (
+                _get_mac_address(self.hostname), self.hostname)
+
+        if command == "show lldp info remote-device\n":
+            return u"\n".join(
+                u"  %-9d | %-25s %-6d %-9d %s" % (
+                    port, _get_mac_address(n), port, port, n)
+                for port, n in enumerate(neighbors, 1))
+
+        if command.startswith("show lldp info remote-device "):
+            name = neighbors[int(command.split()[-1]) - 1]
+            return u"  ChassisId : %s\n  SysName : %s\n" \
+                u"  System Descr : ProCurve\n" \
+                u"  System Capabilities Enabled : bridge\n" % (
+                    _get_mac_address(name), name)
+
+        return u""
+
+
+def _simulated_job(payload):
+    device = loads(payload)
+    _explored.append(device.system_name)
+    explorer = _SimulatedExplorer(
+        device, None, known_mac_addresses=_known_mac_addresses.get())
+    return dumps(explorer.explore_lldp())
+
+
+class CrawlerTester(unittest.TestCase):
+    def setUp(self):
+        self.pool = create_pool("thread", 2)
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def _crawl(self, network, **kwargs):
+        _network.clear()
+        _network.update(network)
+        del _explored[:]
+        crawler = Crawler(self.pool, _fake_job, max_in_flight=2, **kwargs)
+        return crawler, crawler.crawl(Device(system_name="seed"))
+
+    def test_neighbors_explored_once(self):
+        crawler, devices = self._crawl({"seed": ["a", "b"], "a": ["b", "c"],
+                                        "b": ["a", "c", "seed"]})
+        self.assertEqual(sorted(devices), ["a", "b", "c", "seed"])
+        self.assertEqual(crawler.nb_jobs, 4)
+
+    def test_seed_explored_despite_negative_cache(self):
+        negative_cache = NegativeCache(None, {DeviceStatus.UNREACHABLE: 60})
+        for name in ("seed", "a"):
+            negative_cache.add(Device(system_name=name,
+                                      status=DeviceStatus.UNREACHABLE))
+
+        crawler, devices = self._crawl({"seed": ["a", "b"]},
+                                       negative_cache=negative_cache)
+        self.assertEqual(crawler.nb_jobs, 2)
+        self.assertEqual(devices["a"].status, DeviceStatus.UNREACHABLE)
+
+    def test_time_saved_by_negative_cache(self):
+        negative_cache = NegativeCache(None, {DeviceStatus.UNREACHABLE: 60,
+                                              DeviceStatus.AUTH_FAILED: 60})
+        negative_cache.add(Device(system_name="a",
+                                  status=DeviceStatus.UNREACHABLE), 2)
+        negative_cache.add(Device(system_name="b",
+                                  status=DeviceStatus.AUTH_FAILED), 7.5)
+
+        crawler, devices = self._crawl({"seed": ["a", "b", "c"]},
+                                       negative_cache=negative_cache)
+        self.assertEqual(crawler.attempts_avoided, 2)
+        self.assertEqual(crawler.time_saved, 9.5)
+
+    def test_failed_job(self):
+        crawler, devices = self._crawl({"seed": ["broken", "a"]})
+        self.assertEqual(sorted(devices), ["a", "broken", "seed"])
+        self.assertEqual(crawler.nb_jobs, 3)
+
+    def test_abandoned_job_keeps_its_session(self):
+        throttle = Throttle([ThrottleGroup("all", hosts=["*"],
+                                           max_sessions=1)])
+        crawler, devices = self._crawl({"seed": ["hung", "a"]},
+                                       throttle=throttle, job_timeout=0.2)
+        self.assertEqual(devices["hung"].status, DeviceStatus.TIMED_OUT)
+        self.assertEqual(crawler.nb_timed_out, 1)
+        self.assertEqual(_explored, ["seed", "hung", "a"])
+
+    def test_held_devices_keep_their_priority(self):
+        # 'x3' is reported by 'x1' while it waits for the session of 'x1'
+        throttle = Throttle([ThrottleGroup("x", hosts=["x*"],
+                                           max_sessions=1)])
+        crawler, devices = self._crawl(
+            {"seed": ["x1", "x2", "x3"], "x1": ["x3"]}, throttle=throttle,
+            scheduler=CrawlScheduler(["degree"]))
+        self.assertEqual(_explored, ["seed", "x1", "x3", "x2"])
+        self.assertEqual(crawler.nb_jobs, 4)
+
+    def test_unreachable_devices_not_explored(self):
+        crawler, devices = self._crawl(
+            {"seed": ["a", "down"], "a": ["b"]},
+            probe=lambda hostnames: dict((h, h != "down") for h in hostnames))
+        self.assertEqual(sorted(devices), ["a", "b", "down", "seed"])
+        self.assertEqual(devices["down"].status, DeviceStatus.UNREACHABLE)
+        self.assertEqual(crawler.nb_jobs, 3)
+        self.assertEqual(crawler.nb_unreachable, 1)
+
+    def test_degree_counts_the_known_neighbors(self):
+        # 'a' skips the details of 'c', which is still reported by it and
+        # explored before 'b'
+        _network.clear()
+        _network.update({"seed": ["a", "b", "c"], "a": ["c"]})
+        del _explored[:]
+
+        crawler = Crawler(self.pool, _simulated_job,
+                          scheduler=CrawlScheduler(["degree"]),
+                          max_in_flight=1,
+                          known_mac_addresses=_known_mac_addresses)
+        devices = crawler.crawl(Device(system_name="seed"))
+
+        self.assertEqual(len(devices), 4)
+        self.assertEqual(crawler.commands_saved, 1)
+        self.assertEqual(_explored, ["seed", "a", "c", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
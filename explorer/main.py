@@ -9,20 +9,60 @@ Date   : Mars 2015
 import os
 import sys
 import time
-
-from multiprocessing import Process, Manager, Queue
+import signal
+import functools
+import threading
 
 import logging
 import argparse
 import ConfigParser
 
 from network_explorer import *
+from reachability import probe_hosts
+from cache import CredentialMemo, NegativeCache, VendorMemo
+from scheduler import CrawlScheduler
+from throttle import load_throttle
+from result_sink import ResultSink
+from topology import Topology
+from analysis import analyze_vlans
+import serializer
+from crawler import Crawler, ENGINES, KnownMacAddresses, create_pool, \
+    dumps, loads
+
+DEFAULT_WORKERS = 10
+DEFAULT_OUTPUT_FORMAT = "json"
+DEFAULT_PROBE_TIMEOUT = 2
+DEFAULT_SCHEDULER_POLICY = "fifo"
+
+# Seconds given to a device after its deadline before its worker is
+# interrupted, then as much again before the crawler abandons its job
+WATCHDOG_GRACE = 10
+
+# Options of the number of seconds a failure is remembered, by status
+NEGATIVE_CACHE_TTL_OPTIONS = (
+    (DeviceStatus.UNREACHABLE, 'UnreachableTTL', 3600),
+    (DeviceStatus.AUTH_FAILED, 'AuthFailedTTL', 86400))
+
+# State shared by every job executed in the same worker process. It is built
+# once by the pool initializer so that warm workers can be reused.
+_worker = None
 
 
 class Configuration(object):
     pass
 
 
+class _WorkerContext(object):
+    def __init__(self, parser, conf, auth_manager, credential_memo,
+                 vendor_memo, known_mac_addresses):
+        self.parser = parser
+        self.conf = conf
+        self.auth_manager = auth_manager
+        self.credential_memo = credential_memo
+        self.vendor_memo = vendor_memo
+        self.known_mac_addresses = known_mac_addresses
+
+
 def _parse_args():
     parser = argparse.ArgumentParser(
         description="This program dynamically generates documentation for \
@@ -30,6 +70,9 @@ def _parse_args():
         switch using the LLDP protocol.")
     parser.add_argument("config", help="The configuration file.", type=str)
     parser.add_argument('--verbose', '-v', action='store_true')
+    parser.add_argument('--engine', choices=ENGINES, default="process",
+                        help="Explore the devices in worker processes \
+                        (default) or in worker threads of a single process.")
 
     return parser.parse_args()
 
@@ -54,13 +97,118 @@ def _initialize_logger(logfile, verbose):
         logging.getLogger().addHandler(handler)
 
 
-def _write_results_to_file(results, outputfile):
-    output = "{ \"date\": \"" + time.strftime("%c") + "\",\n"
-    values = ",\n".join(value.to_JSON() for value in results.values())
-    output += "\"devices\": [" + values + "]}"
-
-    with open(outputfile, "w") as _file:
-        _file.write(output.encode('utf8'))
+def _get_option(parser, section, option, default, getter=None):
+    """
+    Returns the value of an optional configuration option, or the default
+    value when the option is missing from the configuration file.
+    """
+    if not parser.has_option(section, option):
+        return default
+    return (getter or parser.get)(section, option)
+
+
+def _get_list(parser, section, option, default):
+    """
+    Returns the values of an optional comma-separated option.
+    """
+    value = _get_option(parser, section, option, default)
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _get_options_by_type(parser, section, option, default, convert):
+    """
+    Returns the values of an option which can be overridden for each type of
+    device, such as 'Option.hp = 2'. The value of the option itself applies
+    to every type which is not overridden.
+
+    :return: The values of the option, by device type
+    :rtype: {str : object}
+    """
+    default = _get_option(parser, section, option, default, parser.get)
+    values = dict((t, convert(default)) for t in ("hp", "juniper", "linux"))
+
+    prefix = option.lower() + "."
+    for name, value in parser.items(section):
+        if name.startswith(prefix):
+            values[name[len(prefix):]] = convert(value)
+
+    return values
+
+
+def _get_cache_path(conf, filename):
+    return os.path.join(os.path.expanduser(conf.cache_directory), filename)
+
+
+def _init_worker(parser, conf, auth_manager, credential_memo, vendor_memo,
+                 known_mac_addresses):
+    """
+    Initializes a worker of the pool. This is done only once per
+    worker, no matter how many devices it explores afterwards.
+    """
+    global _worker
+    _worker = _WorkerContext(parser, conf, auth_manager, credential_memo,
+                             vendor_memo, known_mac_addresses)
+
+    # Worker processes can be interrupted in the middle of a blocking call,
+    # while worker threads rely on the deadlines of the explorer
+    if _use_alarm():
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def _use_alarm():
+    return _worker.conf.device_timeout > 0 and \
+        threading.current_thread().name == "MainThread"
+
+
+def _on_alarm(signum, frame):
+    raise DeviceTimeoutError()
+
+
+def _explore_device(payload):
+    """
+    Explores a single device inside a worker of the pool. The device and the
+    result are exchanged with the crawler as pickled strings.
+    """
+    device = loads(payload)
+    conf = _worker.conf
+    # The devices known by the crawler, whose details are not needed
+    known_mac_addresses = _worker.known_mac_addresses.get()
+    explorer = NetworkExplorer(device=device,
+                               parser=_worker.parser,
+                               ssh_timeout=conf.ssh_timeout,
+                               ssh_max_bytes=conf.ssh_max_bytes,
+                               ssh_max_attempts=conf.ssh_max_attempts,
+                               command_timeout=conf.command_timeout,
+                               device_timeout=conf.device_timeout,
+                               batch_size=conf.batch_size,
+                               exec_channels=conf.exec_channels,
+                               detail_channels=conf.detail_channels,
+                               known_mac_addresses=known_mac_addresses,
+                               auth_manager=_worker.auth_manager,
+                               credential_memo=_worker.credential_memo,
+                               vendor_memo=_worker.vendor_memo)
+    start_time = time.time()
+    if _use_alarm():
+        signal.setitimer(signal.ITIMER_REAL,
+                         conf.device_timeout + WATCHDOG_GRACE)
+    # Whatever the explorer collected is kept when it is interrupted
+    try:
+        result = explorer.explore_lldp()
+    except DeviceTimeoutError:
+        logging.error("[%s] Interrupted after %ss", device.system_name,
+                      conf.device_timeout + WATCHDOG_GRACE)
+        explorer.device.status = DeviceStatus.TIMED_OUT
+        result = explorer.get_result()
+    except Exception as e:
+        logging.exception("[%s] Unexpected error during exploration: %s",
+                          device.system_name, e)
+        result = explorer.get_result()
+    finally:
+        if _use_alarm():
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    result.duration = time.time() - start_time
+
+    return dumps(result)
 
 
 def main():
@@ -79,65 +227,183 @@ def main():
     conf.protocol = parser.get('Networkmap', 'Protocol')
     conf.source_address = parser.get('Networkmap', 'SourceAddress')
     conf.outputfile = parser.get('Networkmap', 'OutputFile')
+    conf.output_format = _get_option(parser, 'Networkmap', 'OutputFormat',
+                                     DEFAULT_OUTPUT_FORMAT)
     conf.logfile = parser.get('Networkmap', 'LogFile')
+    conf.workers = _get_option(parser, 'Networkmap', 'Workers',
+                               DEFAULT_WORKERS, parser.getint)
 
     conf.ssh_timeout = parser.getfloat('SSH', 'Timeout')
     conf.ssh_max_bytes = parser.getint('SSH', 'MaximumBytesToReceive')
     conf.ssh_max_attempts = parser.getint('SSH', 'MaximumAttempts')
+    conf.probe_timeout = _get_option(parser, 'SSH', 'ProbeTimeout',
+                                     DEFAULT_PROBE_TIMEOUT, parser.getfloat)
+    conf.command_timeout = _get_option(parser, 'SSH', 'CommandTimeout',
+                                       DEFAULT_COMMAND_TIMEOUT,
+                                       parser.getfloat)
+    conf.device_timeout = _get_option(parser, 'SSH', 'DeviceTimeout',
+                                      DEFAULT_DEVICE_TIMEOUT, parser.getfloat)
+    conf.batch_size = _get_option(parser, 'SSH', 'BatchSize',
+                                  DEFAULT_BATCH_SIZE, parser.getint)
+    conf.exec_channels = _get_option(parser, 'SSH', 'ExecChannels',
+                                     DEFAULT_EXEC_CHANNELS, parser.getint)
+    conf.detail_channels = _get_options_by_type(
+        parser, 'SSH', 'DetailChannels', DEFAULT_DETAIL_CHANNELS, int)
+
+    conf.scheduler_policies = _get_list(parser, 'Scheduler', 'Policy',
+                                        DEFAULT_SCHEDULER_POLICY)
+    conf.scheduler_pinned = _get_list(parser, 'Scheduler', 'Pinned', "")
+
+    conf.cache_directory = _get_option(parser, 'Cache', 'Directory', None)
+    conf.negative_cache_ttls = dict(
+        (status, _get_option(parser, 'Cache', option, default,
+                             parser.getfloat))
+        for status, option, default in NEGATIVE_CACHE_TTL_OPTIONS)
 
     _initialize_logger(conf.logfile, args.verbose)
 
-    queue = Queue()
-    queue.put(Device(system_name=conf.source_address))
-
-    explored_devices = Manager().dict()
-
     if conf.protocol != "LLDP":
         logging.error("Unsupported protocol '%s'.", conf.protocol)
         return
 
+    if conf.workers < 1:
+        logging.error("Invalid number of workers '%s'.", conf.workers)
+        return
+
+    if conf.output_format not in serializer.FORMATS:
+        logging.error("Unsupported output format '%s'.", conf.output_format)
+        return
+    if conf.output_format == "msgpack" and serializer.msgpack is None:
+        logging.error("The 'msgpack' output format requires the msgpack "
+                      "module.")
+        return
+
+    try:
+        scheduler = CrawlScheduler(conf.scheduler_policies,
+                                   conf.scheduler_pinned)
+        throttle = load_throttle(parser)
+    except ValueError as e:
+        logging.error("%s.", e)
+        return
+
+    # The credentials are loaded once, before the workers are started
+    auth_manager = AuthManager(parser)
+    auth_manager.preload()
+
+    # The workers get the credentials and the device types found during the
+    # previous runs, while the crawler records the ones found during this run
+    credential_memo = None
+    vendor_memo = None
+    if conf.cache_directory:
+        credential_memo = CredentialMemo(
+            _get_cache_path(conf, "credentials.json"))
+        vendor_memo = VendorMemo(_get_cache_path(conf, "vendors.json"))
+
+    # Shared with the workers once, before they start
+    known_mac_addresses = KnownMacAddresses()
+
+    pool = create_pool(args.engine, conf.workers, _init_worker,
+                       (parser, conf, auth_manager, credential_memo,
+                        vendor_memo, known_mac_addresses))
+
     start_time = time.time()
 
-    jobs = []
+    probe = None
+    if conf.probe_timeout > 0:
+        probe = functools.partial(probe_hosts, timeout=conf.probe_timeout)
 
-    while True:
-        # Starting a new process for each device added in the queue
-        if not queue.empty():  # and len(jobs) < 10:
-            nextDevice = queue.get()
+    negative_cache = None
+    if conf.cache_directory:
+        negative_cache = NegativeCache(
+            _get_cache_path(conf, "negative_cache.json"),
+            conf.negative_cache_ttls, auth_manager.get_digest())
 
-            explorer = NetworkExplorer(device=nextDevice,
-                                       parser=parser,
-                                       ssh_timeout=conf.ssh_timeout,
-                                       ssh_max_bytes=conf.ssh_max_bytes,
-                                       ssh_max_attempts=conf.ssh_max_attempts)
+    job_timeout = None
+    if conf.device_timeout > 0:
+        job_timeout = conf.device_timeout + 2 * WATCHDOG_GRACE
 
-            p = Process(
-                target=explorer.explore_lldp,
-                args=(explored_devices, queue),
-                name=nextDevice.system_name)
+    # The devices are written as soon as they are explored
+    sink = ResultSink(conf.outputfile, conf.output_format)
 
-            jobs.append(p)
-            p.start()
+    crawler = Crawler(pool, _explore_device, probe, negative_cache,
+                      credential_memo, vendor_memo, scheduler, conf.workers,
+                      throttle, job_timeout, sink, known_mac_addresses,
+                      conf.probe_timeout)
+    try:
+        explored_devices = crawler.crawl(
+            Device(system_name=conf.source_address))
+    except KeyboardInterrupt:
+        pool.terminate()
+        sink.close()
+        logging.error("Interrupted. The devices explored so far are in "
+                      "'%s'.", sink.part_path)
+        return
+
+    # Workers stuck on an abandoned job would never finish
+    if crawler.nb_timed_out > 0:
+        pool.terminate()
+    else:
+        pool.close()
+        pool.join()
 
-        # Removing every process who's finished
-        for j in jobs:
-            if not j.is_alive():
-                jobs.remove(j)
+    if negative_cache is not None:
+        negative_cache.save()
+    if credential_memo is not None:
+        credential_memo.save()
+    if vendor_memo is not None:
+        vendor_memo.save()
 
-        # We're done when there aren't any process left
-        if len(jobs) == 0:
-            break
-        time.sleep(1)
+    elapsed_time = time.time() - start_time
 
     if len(explored_devices) > 0:
-        _write_results_to_file(explored_devices, conf.outputfile)
-
-        logging.info("Found %s device(s) in %s second(s).",
+        analysis_start_time = time.time()
+        topology = Topology(explored_devices)
+        edges = topology.get_edges()
+        vlan_analysis = analyze_vlans(topology)
+        logging.info("Found %s edge(s), %s link(s) with different VLANs on "
+                     "both ends and %s device(s) with orphan VLANs in %s "
+                     "second(s).", len(edges),
+                     len(vlan_analysis["mismatches"]),
+                     len(vlan_analysis["orphans"]),
+                     round(time.time() - analysis_start_time, 3))
+
+        sink.write_remaining(explored_devices)
+        sink.finalize(edges=edges, vlan_analysis=vlan_analysis)
+
+        logging.info("Found %s device(s) in %s second(s) (%s device(s)/s).",
                      len(explored_devices),
-                     round(time.time() - start_time, 2))
+                     round(elapsed_time, 2),
+                     round(len(explored_devices) / max(elapsed_time, 0.001),
+                           2))
+        logging.info("Found 90%% of the devices in %s second(s) (%s).",
+                     round(crawler.get_discovery_time(0.9), 2),
+                     ", ".join(conf.scheduler_policies))
     else:
+        sink.discard()
         logging.warning("Could not find anything.")
 
+    logging.info("Exchanged %s byte(s) with the workers (%s byte(s)/device).",
+                 crawler.ipc_bytes,
+                 crawler.ipc_bytes / max(crawler.nb_jobs, 1))
+
+    logging.info("Skipped %s unreachable device(s) without any SSH attempt.",
+                 crawler.nb_unreachable)
+    logging.info("Avoided %s connection attempt(s) to devices which failed "
+                 "during previous runs, saving about %.1f second(s).",
+                 crawler.attempts_avoided, crawler.time_saved)
+    logging.info("Skipped %s LLDP detail command(s) for known neighbors.",
+                 crawler.commands_saved)
+    logging.info("Abandoned %s device(s) which did not answer in time.",
+                 crawler.nb_timed_out)
+
+    if throttle is not None:
+        for group in throttle.groups:
+            logging.info("Throttled the '%s' devices during %s second(s).",
+                         group.name, round(group.throttled_time, 2))
+
+    for name, histogram in sorted(crawler.command_latencies.items()):
+        logging.info("Latency of '%s': %s", name, histogram)
+
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Upper bounds (in milliseconds) of the buckets of the latency histograms
+LATENCY_BUCKETS_MS = tuple(2 ** i for i in range(18))
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of durations using logarithmic buckets, which is cheap to send
+    back from the workers and to merge in the crawler.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and \
+                milliseconds > LATENCY_BUCKETS_MS[index]:
+            index += 1
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound (in milliseconds) of the bucket containing
+        the given percentile, or None if nothing was recorded.
+        """
+        if self.count == 0:
+            return None
+
+        threshold = self.count * percent / 100.0
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= threshold and count > 0:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return LATENCY_BUCKETS_MS[index]
+                break
+
+        return int(self.maximum * 1000)
+
+    def __str__(self):
+        return "n=%d avg=%dms p50<=%sms p90<=%sms p99<=%sms max=%dms" % (
+            self.count,
+            self.total * 1000 / max(self.count, 1),
+            self.percentile(50),
+            self.percentile(90),
+            self.percentile(99),
+            self.maximum * 1000)
+
+
+def merge_histograms(target, histograms):
+    """
+    Merges a dict of histograms into 'target', by name.
+    """
+    for name, histogram in histograms.iteritems():
+        if name not in target:
+            target[name] = LatencyHistogram()
+        target[name].merge(histogram)
@@ -7,18 +7,58 @@ Date   : Mars 2015
 """
 
 import re
+import copy
 import time
 import socket
+import select
 import logging
+import threading
 
 import paramiko
 
 from output_parser import *
 from auth_manager import AuthManager, AuthConfigError, NoAuthRequested
+from metrics import LatencyHistogram, merge_histograms
+from reachability import RetryPolicy
+from terminal import TerminalDecoder, ReceiveBuffer, PromptCounter
 
 DEFAULT_TIMEOUT = 10
 DEFAULT_MAX_BYTES = 1024
 DEFAULT_MAX_ATTEMPTS = 1
+DEFAULT_COMMAND_TIMEOUT = 30
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_EXEC_CHANNELS = 0
+DEFAULT_DETAIL_CHANNELS = 1
+DEFAULT_DEVICE_TIMEOUT = 300
+
+# Only the end of the output needs to be searched for the prompt
+PROMPT_SEARCH_LENGTH = 256
+
+# The size of the reads grows up to this size for large outputs
+MAX_READ_SIZE = 65536
+
+
+class DeviceTimeoutError(Exception):
+    pass
+
+
+class ExplorationResult(object):
+    """
+    What a worker sends back to the crawler once a device has been explored.
+    """
+
+    def __init__(self, device, neighbors=None, command_latencies=None):
+        self.device = device
+        self.neighbors = neighbors or []
+        self.commands_saved = 0
+        self.duration = 0
+        # The hostname which was explored, and the credential set which
+        # worked for it, if any
+        self.hostname = device.system_name if device else None
+        self.credentials = None
+        self.command_latencies = command_latencies
+        if command_latencies is None:
+            self.command_latencies = {}
 
 
 class NetworkExplorer(object):
@@ -32,7 +72,16 @@ class NetworkExplorer(object):
                  parser,
                  ssh_timeout=DEFAULT_TIMEOUT,
                  ssh_max_bytes=DEFAULT_MAX_BYTES,
-                 ssh_max_attempts=DEFAULT_MAX_ATTEMPTS):
+                 ssh_max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 command_timeout=DEFAULT_COMMAND_TIMEOUT,
+                 device_timeout=DEFAULT_DEVICE_TIMEOUT,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 exec_channels=DEFAULT_EXEC_CHANNELS,
+                 detail_channels=None,
+                 known_mac_addresses=None,
+                 auth_manager=None,
+                 credential_memo=None,
+                 vendor_memo=None):
 
         self.network_parser = None
 
@@ -42,51 +91,129 @@ class NetworkExplorer(object):
         self.ssh_timeout = ssh_timeout
         self.ssh_max_bytes = ssh_max_bytes
         self.ssh_max_attempts = ssh_max_attempts
-
-        self._auth_manager = AuthManager(parser)
-
-    def explore_lldp(self, explored_devices, queue):
+        self.command_timeout = command_timeout
+        # Total time allowed for the exploration of the device, if any
+        self.device_timeout = device_timeout
+        self._deadline = None
+        self._neighbors = None
+        self.batch_size = batch_size
+        self.exec_channels = exec_channels
+        # Number of shell channels used for the LLDP details, by device type
+        self.detail_channels = detail_channels or {}
+
+        # MAC addresses (as bytes) of the devices already known by the crawler
+        self.known_mac_addresses = known_mac_addresses or set()
+        self.commands_saved = 0
+
+        self.command_latencies = {}
+
+        self._auth_manager = auth_manager or AuthManager(parser)
+        # The credential sets which worked during the previous runs
+        self._credential_memo = credential_memo
+        self.credentials = None
+        # The types of the devices explored during the previous runs
+        self._vendor_memo = vendor_memo
+
+    def explore_lldp(self):
         """
-        Explores a device using the LLDP protocol in order to add its
-        valid neighbors in the queue.
+        Explores a device using the LLDP protocol in order to find its
+        valid neighbors.
 
-        :param explored_devices: The dict of the devices already explored
-        :type explored_devices: {str : Device}
-        :param queue: The queue of the next devices to explore
-        :type queue: Queue()
+        :return: The explored device along with its valid neighbors
+        :rtype: ExplorationResult
         """
+        if self.device_timeout:
+            self._deadline = time.time() + self.device_timeout
 
         try:
             self._open_ssh_connection()
         except NoAuthRequested as e:
             logging.info("[%s] No auth requested", self.hostname)
             self.device.status = DeviceStatus.NO_AUTH_REQUESTED
-            return
+            return self.get_result()
         except paramiko.AuthenticationException as pae:
             logging.error("[%s] Authentication failed: %s", self.hostname, pae)
             self.device.status = DeviceStatus.AUTH_FAILED
-            return
+            return self.get_result()
+        except DeviceTimeoutError as e:
+            logging.error("[%s] Timed out while connecting", self.hostname)
+            self.device.status = DeviceStatus.TIMED_OUT
+            return self.get_result()
         except Exception as e:
             logging.error("[%s] Could not open SSH connection: %s",
                           self.hostname, e)
             self.device.status = DeviceStatus.UNREACHABLE
-            return
+            return self.get_result()
+
+        # Whatever was collected before the deadline is kept
+        try:
+            self._explore_connected_device()
+        except DeviceTimeoutError as e:
+            logging.error("[%s] Timed out after %ss, keeping what was "
+                          "collected", self.hostname, self.device_timeout)
+            self.device.status = DeviceStatus.TIMED_OUT
         finally:
-            if self.device.mac_address:
-                explored_devices[self.device.mac_address] = self.device
+            self._close_ssh_connection()
 
-        # Determining the type of the current device from the switch banner
-        banner = self._receive_ssh_output()
-        self.network_parser = NetworkOutputParser.get_parser_type(banner)
+        return self.get_result()
 
-        if self.network_parser is None:
-            logging.warning(
-                "[%s] Unsupported device type. Prompt was: %s",
-                self.hostname, banner)
-            return
+    def get_result(self):
+        """
+        Returns what was collected so far about the device and its valid
+        neighbors, which is also what is kept of an interrupted exploration.
+
+        :rtype: ExplorationResult
+        """
+        result = ExplorationResult(
+            self.device, command_latencies=self.command_latencies)
+        result.hostname = self.hostname
+        result.credentials = self.credentials
+        result.commands_saved = self.commands_saved
+
+        # Deduplication against the whole network is done by the crawler,
+        # only the valid neighbors are sent back to it.
+        macs = set()
+        for neighbor in self._neighbors or []:
+            if neighbor.is_valid_lldp_device() and \
+               neighbor.mac_address not in macs:
+                macs.add(neighbor.mac_address)
+                result.neighbors.append(neighbor)
+
+        return result
+
+    def _explore_connected_device(self):
+        """
+        Explores the device once connected.
 
-        # Preparing the switch, such as removing pagination
-        self._prepare_switch()
+        :return: The neighbors of the device, or None if it could not be
+                 explored
+        :rtype: [Device]
+        """
+        self._neighbors = None
+
+        # When the type of the device is already known, it is prepared
+        # without waiting for its banner
+        self.network_parser = NetworkOutputParser.get_parser_for_type(
+            self._get_expected_type())
+
+        prepared, banner = False, None
+        if self.network_parser is not None:
+            prepared, banner = self._prepare_switch_ahead()
+
+        if not prepared:
+            # Determining the type of the current device from the switch banner
+            if banner is None:
+                banner = self._receive_banner()
+            self.network_parser = NetworkOutputParser.get_parser_type(banner)
+
+            if self.network_parser is None:
+                logging.warning(
+                    "[%s] Unsupported device type. Prompt was: %s",
+                    self.hostname, banner)
+                return None
+
+            # Preparing the switch, such as removing pagination
+            self._prepare_switch()
 
         # Building current device's informations if missing
         if self.device is None or self.device.mac_address is None:
@@ -96,15 +223,17 @@ class NetworkExplorer(object):
                     parse_device_from_lldp_local_info(local_report)
                 if not self.device.mac_address:
                     raise ValueError()
+            except DeviceTimeoutError:
+                raise
             except Exception as e:
                 logging.error(
                     "[%s] Unable to parse lldp local report using %s: %s",
                     self.hostname,
                     self.network_parser.__class__.__name__,
                     e)
-                return
+                return None
 
-        neighbors = self._build_lldp_neighbors()
+        self._neighbors = self._build_lldp_neighbors()
 
         self._assign_vlans_to_interfaces()
 
@@ -112,17 +241,7 @@ class NetworkExplorer(object):
 
         self._assign_vms_to_device()
 
-        self._close_ssh_connection()
-
-        explored_devices[self.device.mac_address] = self.device
-
-        for neighbor in neighbors:
-            valid = neighbor.is_valid_lldp_device()
-            explored = neighbor.mac_address in explored_devices
-
-            if valid and not explored:
-                explored_devices[neighbor.mac_address] = neighbor
-                queue.put(neighbor)
+        return self._neighbors
 
     def _build_lldp_neighbors(self):
         """
@@ -144,12 +263,26 @@ class NetworkExplorer(object):
             neighbors = []
             return neighbors
 
-        lldp_neighbors_details = []
-        for interface in self.device.interfaces.values():
-            if interface.is_valid_lldp_interface():
-                port = interface.local_port
-                detail = self._get_lldp_neighbor_detail(port)
-                lldp_neighbors_details.append(detail)
+        # The details are only needed to discover new devices, so they are
+        # fetched once per unknown remote chassis instead of once per port
+        ports = []
+        remote_chassis = set()
+        for interface in sorted(self.device.interfaces.values(),
+                                key=lambda i: i.local_port):
+            if not interface.is_valid_lldp_interface():
+                continue
+
+            chassis = mac_address_to_bytes(interface.remote_mac_address)
+            if chassis is not None and (
+                    chassis in self.known_mac_addresses or
+                    chassis in remote_chassis):
+                self.commands_saved += 1
+                continue
+
+            remote_chassis.add(chassis)
+            ports.append(interface.local_port)
+
+        lldp_neighbors_details = self._get_lldp_neighbors_details(ports)
 
         neighbors = self.network_parser.parse_devices_from_lldp_remote_info(
             self.device, lldp_neighbors_details)
@@ -175,9 +308,13 @@ class NetworkExplorer(object):
 
         # Other devices need to get specific information from each vlan before
         # assigning it one by one to the interfaces
-        for vlan in vlans.values():
-            detail_str = self.network_parser.get_vlan_detail_str(vlan)
-            specific_result = self._get_vlan_detail(detail_str)
+        vlans = vlans.values()
+        specific_results = self._get_vlans_details(
+            [self.network_parser.get_vlan_detail_str(v) for v in vlans])
+
+        for vlan, specific_result in zip(vlans, specific_results):
+            if not specific_result:
+                continue
             self.network_parser.associate_vlan_to_interfaces(
                 self.device.interfaces, vlan, specific_result)
 
@@ -209,9 +346,17 @@ class NetworkExplorer(object):
         command = self.network_parser.lldp_neighbors_cmd
         return self._send_ssh_command(command)
 
-    def _get_lldp_neighbor_detail(self, port):
-        command = self.network_parser.lldp_neighbors_detail_cmd.format(port)
-        return self._send_ssh_command(command)
+    def _get_lldp_neighbors_details(self, ports):
+        command = self.network_parser.lldp_neighbors_detail_cmd
+        commands = [command.format(p) for p in ports]
+
+        nb_channels = self.detail_channels.get(
+            self.network_parser.device_type, DEFAULT_DETAIL_CHANNELS)
+
+        if nb_channels <= 1 or len(commands) <= 1:
+            return self._send_ssh_commands(commands)
+
+        return self._send_ssh_commands_on_channels(commands, nb_channels)
 
     def _get_trunks(self):
         command = self.network_parser.trunks_list_cmd
@@ -221,9 +366,9 @@ class NetworkExplorer(object):
         command = self.network_parser.vlans_global_cmd
         return self._send_ssh_command(command)
 
-    def _get_vlan_detail(self, vlan_id):
-        command = self.network_parser.vlans_specific_cmd.format(vlan_id)
-        return self._send_ssh_command(command)
+    def _get_vlans_details(self, vlans_ids):
+        command = self.network_parser.vlans_specific_cmd
+        return self._send_ssh_commands([command.format(v) for v in vlans_ids])
 
     def _get_virtual_machines(self):
         command = self.network_parser.vms_list_cmd
@@ -231,35 +376,99 @@ class NetworkExplorer(object):
 
     def _open_ssh_connection(self):
         """
-        Opens a SSH connection with the device
+        Opens a SSH connection with the device, trying each credential set
+        in order until one is accepted
         """
+        credentials = self._auth_manager.get_credentials(self.hostname,
+                                                         self.device.type)
+        if self._credential_memo is not None:
+            credentials = self._credential_memo.sort(
+                credentials, self.hostname, self.device.type,
+                self.device.ip_address)
+
+        for index, (name, options) in enumerate(credentials):
+            try:
+                if index == 0:
+                    self._connect(options)
+                else:
+                    self._authenticate(options)
+            except paramiko.AuthenticationException as pae:
+                logging.debug("[%s] Credentials '%s' rejected",
+                              self.hostname, name)
+                if index == len(credentials) - 1:
+                    raise
+            else:
+                self.credentials = name
+                break
+
+        self._open_shell()
 
-        kwargs = self._auth_manager.get_params(self.hostname, self.device.type)
+        logging.info("[%s] SSH connection established", self.hostname)
 
+    def _connect(self, options):
+        """
+        Connects to the device with the given credentials, retrying when the
+        connection itself fails
+        """
+        kwargs = dict(options)
         kwargs.update({
             "hostname": self.hostname,
             "look_for_keys": False,
             "allow_agent": False,
             "timeout": self.ssh_timeout})
 
-        nb_attempts = 0
-        while nb_attempts <= 3:
+        retry_policy = RetryPolicy(self.ssh_max_attempts)
+        for attempt in range(1, retry_policy.max_attempts + 1):
             try:
                 self.ssh = paramiko.SSHClient()
                 self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
                 self.ssh.connect(**kwargs)
             except paramiko.AuthenticationException as pae:
                 raise  # Do not retry if authentication failed
+            except DeviceTimeoutError:
+                self.ssh.close()
+                raise
             except Exception as e:
-                nb_attempts += 1
+                self.ssh.close()
+                if attempt == retry_policy.max_attempts:
+                    raise
+
+                delay = retry_policy.get_delay(attempt)
+                if self._deadline is not None and \
+                   time.time() + delay >= self._deadline:
+                    raise DeviceTimeoutError()
+
+                logging.debug("[%s] Connection attempt %d failed (%s), "
+                              "retrying in %.1fs", self.hostname, attempt, e,
+                              delay)
+                time.sleep(delay)
             else:
                 break
 
-        self.shell = self.ssh.invoke_shell()
-        self.shell.set_combine_stderr(True)
+    def _authenticate(self, options):
+        """
+        Tries other credentials on the transport of a rejected attempt, which
+        saves a new handshake. Connects again if the device closed it.
+        """
+        transport = self.ssh.get_transport()
+        if transport is None or not transport.is_active():
+            self._connect(options)
+            return
 
-        logging.info("[%s] SSH connection established", self.hostname)
-        time.sleep(1)
+        try:
+            if "pkey" in options:
+                transport.auth_publickey(options["username"], options["pkey"])
+            else:
+                transport.auth_password(options["username"],
+                                        options["password"])
+        except paramiko.AuthenticationException:
+            raise
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            # The device dropped the connection after the rejected attempt
+            logging.debug("[%s] Connection lost while authenticating (%s), "
+                          "connecting again", self.hostname, e)
+            self.ssh.close()
+            self._connect(options)
 
     def _close_ssh_connection(self):
         """
@@ -286,67 +495,448 @@ class NetworkExplorer(object):
         if command is None:
             return None
 
+        if self._use_exec_channels():
+            return self._send_exec_commands([command])[0]
+
+        deadline = self._get_deadline(self.command_timeout)
         try:
             logging.debug("[%s] Sending: %s", self.hostname, repr(command))
+            start_time = time.time()
             self.shell.send(command)
 
-            receive_buffer = ""
-            wait_string = self.network_parser.wait_string
-            length_when_mark_detected = 0
-            empty_buffer_count = 0
+            receive_buffer = self._receive_until(
+                self.network_parser.prompt_regex, deadline)
 
-            while True:
-                temp_buffer = self._receive_ssh_output()
-                receive_buffer += temp_buffer
-                if not temp_buffer:
-                    empty_buffer_count += 1
-                else:
-                    empty_buffer_count = 0
+            latency = time.time() - start_time
+            self._record_latency(command, latency)
+
+            logging.debug("[%s] Got response (len=%d) in %.3fs",
+                          self.hostname, len(receive_buffer), latency)
+
+            return receive_buffer
+
+        except DeviceTimeoutError:
+            raise
+        except Exception as e:
+            logging.warning("[%s] Could not send command '%s': %s",
+                            self.hostname, command, e)
+
+    def _get_deadline(self, timeout):
+        """
+        Returns the time at which an operation of 'timeout' seconds must end,
+        which is never after the deadline of the device.
+        """
+        self._check_deadline()
+
+        deadline = time.time() + timeout
+        if self._deadline is not None:
+            deadline = min(deadline, self._deadline)
+        return deadline
+
+    def _check_deadline(self):
+        """
+        Gives up on the device once its deadline is reached.
+        """
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise DeviceTimeoutError()
+
+    def _receive_banner(self):
+        """
+        Receives the banner of the device, which ends as soon as the device
+        shows that it is ready to receive commands. Devices which are already
+        ready are not waited for.
 
-                if wait_string in receive_buffer[length_when_mark_detected:]:
-                    length_when_mark_detected = len(receive_buffer)
+        :return: Returns the banner of the device
+        :rtype: str
+        """
+        return self._receive_until(BANNER_END_REGEX,
+                                   self._get_deadline(self.ssh_timeout))
 
-                if length_when_mark_detected > 0 and empty_buffer_count == 3:
+    def _receive_until(self, prompt_regex, deadline, nb_prompts=1):
+        """
+        Receives the output of the device until the given prompt shows up at
+        the end of it. Instead of polling, this waits for the channel to be
+        ready and gives up once the deadline is reached.
+
+        :param prompt_regex: The prompt ending the output
+        :type prompt_regex: re.RegexObject
+        :param deadline: The time at which to stop waiting for the prompt
+        :type deadline: float
+        :param nb_prompts: The number of prompts to wait for, when several
+                           commands have been sent at once
+        :type nb_prompts: int
+        :return: Returns everything received
+        :rtype: str
+        """
+        receive_buffer = ReceiveBuffer(PROMPT_SEARCH_LENGTH)
+        prompt_counter = None
+        if nb_prompts > 1:
+            prompt_counter = PromptCounter(
+                self.network_parser.line_prompt_regex)
+
+        while True:
+            temp_buffer = self._receive_ssh_output()
+            if temp_buffer:
+                receive_buffer.append(temp_buffer)
+                nb_found = prompt_counter.feed(temp_buffer) \
+                    if prompt_counter is not None else 1
+                if prompt_regex.search(receive_buffer.tail) and \
+                   nb_found >= nb_prompts:
                     break
+                continue
 
-                time.sleep(0.1)
+            if self.shell.closed:
+                break
 
-            logging.debug("[%s] Got response (len=%d)", self.hostname,
-                          length_when_mark_detected)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logging.warning("[%s] Timed out waiting for the prompt",
+                                self.hostname)
+                break
 
-            return receive_buffer
+            select.select([self.shell], [], [], remaining)
+
+        receive_buffer.append(self._decoder.flush())
+        return receive_buffer.getvalue()
 
+    def _send_ssh_commands(self, commands):
+        """
+        Sends several commands to the device and returns their outputs in the
+        same order. When the device supports it, the commands are sent by
+        batches of 'batch_size' commands without waiting for the output of
+        each one, which saves a round trip per command.
+
+        :param commands: The commands to execute (must end by a '\\n')
+        :type commands: [str]
+        :return: Returns the (clean) result from each command's output
+        :rtype: [str]
+        """
+        if self._use_exec_channels():
+            return self._send_exec_commands(commands)
+
+        if self.batch_size <= 1 or \
+           not self.network_parser.supports_batching:
+            return [self._send_ssh_command(c) for c in commands]
+
+        outputs = []
+        for i in range(0, len(commands), self.batch_size):
+            batch = commands[i:i + self.batch_size]
+            if len(batch) == 1:
+                outputs.append(self._send_ssh_command(batch[0]))
+            else:
+                outputs.extend(self._send_ssh_batch(batch))
+
+        return outputs
+
+    def _send_ssh_batch(self, commands):
+        """
+        Sends a batch of commands back-to-back on the shell, then splits what
+        was received on the prompts shown after each command.
+        """
+        deadline = self._get_deadline(self.command_timeout * len(commands))
+        try:
+            logging.debug("[%s] Sending batch: %s", self.hostname,
+                          repr(commands))
+            start_time = time.time()
+            self.shell.send("".join(commands))
+
+            receive_buffer = self._receive_until(
+                self.network_parser.prompt_regex, deadline, len(commands))
+
+            latency = time.time() - start_time
+            for command in commands:
+                self._record_latency(command, latency / len(commands))
+
+            logging.debug("[%s] Got batch response (len=%d) in %.3fs",
+                          self.hostname, len(receive_buffer), latency)
+
+            # Each output goes up to the end of its prompt, just like it
+            # does when the commands are sent one by one
+            outputs = []
+            start = 0
+            for prompt in self._find_prompts(receive_buffer)[:len(commands)]:
+                outputs.append(receive_buffer[start:prompt.end()])
+                start = prompt.end()
+
+            if len(outputs) < len(commands):
+                logging.warning("[%s] Got %d output(s) for %d commands",
+                                self.hostname, len(outputs), len(commands))
+                outputs.append(receive_buffer[start:])
+
+            return (outputs + [u""] * len(commands))[:len(commands)]
+
+        except DeviceTimeoutError:
+            raise
         except Exception as e:
-            logging.warning("[%s] Could not send command '%s': %s",
-                            self.hostname, command, e)
+            logging.warning("[%s] Could not send commands %s: %s",
+                            self.hostname, commands, e)
+            return [u""] * len(commands)
+
+    def _send_ssh_commands_on_channels(self, commands, nb_channels):
+        """
+        Spreads commands over the current shell and additional shells opened
+        on the same transport, which run concurrently. The outputs are
+        returned in the same order as the commands.
+
+        :param commands: The commands to execute (must end by a '\\n')
+        :type commands: [str]
+        :param nb_channels: The maximum number of shells to use
+        :type nb_channels: int
+        :return: Returns the (clean) result from each command's output
+        :rtype: [str]
+        """
+        explorers = [self]
+        for _ in range(min(nb_channels, len(commands)) - 1):
+            try:
+                explorers.append(self._open_additional_shell())
+            except Exception as e:
+                # Some devices limit the number of concurrent sessions
+                logging.debug("[%s] Could not open an additional shell: %s",
+                              self.hostname, e)
+                break
+
+        outputs = [None] * len(commands)
+
+        def send(explorer, indexes):
+            try:
+                results = explorer._send_ssh_commands([commands[i]
+                                                       for i in indexes])
+            except DeviceTimeoutError:
+                return
+            for index, result in zip(indexes, results):
+                outputs[index] = result
+
+        threads = []
+        for number, explorer in enumerate(explorers[1:], 1):
+            indexes = range(number, len(commands), len(explorers))
+            thread = threading.Thread(target=send, args=(explorer, indexes))
+            thread.start()
+            threads.append(thread)
+
+        send(self, range(0, len(commands), len(explorers)))
+
+        for thread in threads:
+            thread.join()
+
+        for explorer in explorers[1:]:
+            explorer.shell.close()
+            merge_histograms(self.command_latencies,
+                             explorer.command_latencies)
+
+        # Every shell gives up once the deadline of the device is reached
+        self._check_deadline()
+
+        return outputs
+
+    def _open_additional_shell(self):
+        """
+        Opens another shell on the current SSH transport and prepares it.
+
+        :return: A copy of this explorer which uses the new shell
+        :rtype: NetworkExplorer
+        """
+        explorer = copy.copy(self)
+        explorer.command_latencies = {}
+
+        explorer._open_shell()
+
+        explorer._receive_banner()
+        explorer._prepare_switch()
+
+        return explorer
+
+    def _use_exec_channels(self):
+        return self.exec_channels > 0 and \
+            self.network_parser.supports_exec_channels
+
+    def _send_exec_commands(self, commands):
+        """
+        Executes commands in their own exec channel, up to 'exec_channels'
+        at the same time on the SSH transport. The end of each output and its
+        exit status are given by the protocol, so no prompt is involved.
+
+        :param commands: The commands to execute
+        :type commands: [str]
+        :return: Returns the result from each command's output
+        :rtype: [str]
+        """
+        transport = self.ssh.get_transport()
+
+        outputs = [None] * len(commands)
+        waiting = list(enumerate(commands))
+        running = {}
+
+        while waiting or running:
+            if self._deadline is not None and time.time() >= self._deadline:
+                for channel in running:
+                    channel.close()
+                raise DeviceTimeoutError()
+
+            while waiting and len(running) < self.exec_channels:
+                index, command = waiting.pop(0)
+                try:
+                    logging.debug("[%s] Executing: %s", self.hostname,
+                                  repr(command))
+                    channel = transport.open_session()
+                    channel.set_combine_stderr(True)
+                    channel.exec_command(command.strip())
+                    running[channel] = (index, command, [], time.time())
+                except DeviceTimeoutError:
+                    raise
+                except Exception as e:
+                    logging.warning("[%s] Could not execute command '%s': %s",
+                                    self.hostname, command, e)
+
+            if not running:
+                continue
+
+            oldest = min(start for _, _, _, start in running.values())
+            remaining = oldest + self.command_timeout - time.time()
+            if self._deadline is not None:
+                remaining = min(remaining, self._deadline - time.time())
+            select.select(running.keys(), [], [], max(remaining, 0))
+
+            for channel in running.keys():
+                index, command, chunks, start_time = running[channel]
+
+                while channel.recv_ready():
+                    chunks.append(channel.recv(self.ssh_max_bytes))
+
+                finished = channel.eof_received or channel.closed
+                timed_out = time.time() - start_time > self.command_timeout
+                if not finished and not timed_out:
+                    continue
+
+                if timed_out and not finished:
+                    logging.warning("[%s] Timed out executing '%s'",
+                                    self.hostname, command)
+                elif channel.exit_status_ready():
+                    logging.debug("[%s] '%s' exited with status %d",
+                                  self.hostname, command.strip(),
+                                  channel.recv_exit_status())
+
+                channel.close()
+                del running[channel]
+
+                self._record_latency(command, time.time() - start_time)
+                outputs[index] = "".join(chunks).decode('utf8', 'replace')
+
+        return outputs
+
+    def _find_prompts(self, receive_buffer):
+        """
+        Returns the matches of every prompt found at the start of a line.
+        """
+        return list(self.network_parser.line_prompt_regex.finditer(
+            receive_buffer))
+
+    def _record_latency(self, command, latency):
+        """
+        Records the latency of a command in the histogram of its kind. The
+        arguments of the command (such as ports or vlans identifiers) are
+        left out of the name of the histogram.
+        """
+        name = " ".join(t for t in command.split()
+                        if not any(c.isdigit() for c in t)) or repr(command)
+
+        if name not in self.command_latencies:
+            self.command_latencies[name] = LatencyHistogram()
+        self.command_latencies[name].record(latency)
 
     def _receive_ssh_output(self):
         """
         Receives the raw output from the device after a command has been
-        sent and cleans it before returning.
+        sent and cleans it before returning. The size of the reads grows
+        while the device has more to send than what can be read at once.
 
         :return: Returns the cleaned output of the device
-        :rtype: str
+        :rtype: unicode
         """
         if self.shell.recv_ready():
-            raw_output = self.shell.recv(self.ssh_max_bytes)
-            return self._remove_ansi_escape_codes(raw_output.decode('utf8'))
+            raw_output = self.shell.recv(self._read_size)
+            if len(raw_output) == self._read_size:
+                self._read_size = min(self._read_size * 2, MAX_READ_SIZE)
+            return self._decoder.decode(raw_output)
         else:
             return ""
 
-    def _remove_ansi_escape_codes(self, string):
+    def _open_shell(self):
         """
-        Cleans a string by removing all ANSI and VT100 escape characters
-        using a regular expression.
+        Opens an interactive shell on the current SSH connection.
+        """
+        self.shell = self.ssh.invoke_shell()
+        self.shell.set_combine_stderr(True)
 
-        :param string: The string to clean
-        :type string: str
-        :return: Returns the cleaned string
-        :rtype: str
+        self._decoder = TerminalDecoder()
+        self._read_size = self.ssh_max_bytes
+
+    def _get_expected_type(self):
+        """
+        Returns the type of the device as described by its neighbors, or as
+        found during a previous run.
+        """
+        if self.device.type is not None:
+            return self.device.type
+        if self._vendor_memo is not None:
+            return self._vendor_memo.get(self.hostname)
+        return None
+
+    def _prepare_switch_ahead(self):
         """
-        expression = r"\[\d{1,2}\;\d{1,2}[a-zA-Z]?\d?|\[\??\d{1,2}[a-zA-Z]"
-        ansi_escape = re.compile(expression)
-        return ansi_escape.sub('', string.replace(u"\u001b", ""))
+        Sends every preparation command as soon as the shell is opened,
+        without waiting for the banner, then waits for the prompt shown after
+        the last one.
+
+        :return: Whether the device is ready, and everything received
+        :rtype: (bool, str)
+        """
+        commands = self.network_parser.preparation_cmds
+        prompt_regex = self.network_parser.prompt_regex
+
+        start_time = time.time()
+        deadline = self._get_deadline(self.ssh_timeout +
+                                      self.command_timeout * len(commands))
+
+        if commands:
+            logging.debug("[%s] Sending ahead: %s", self.hostname,
+                          repr(commands))
+            self.shell.send("".join(commands))
+
+        # Prompts may show up in the banner, so only the one following the
+        # echo of the last command tells that every command is done
+        last_command = commands[-1].strip() if commands else ""
+        output = u""
+        prepared = True
+        while True:
+            output += self._receive_until(BANNER_END_REGEX, deadline)
+
+            index = output.rfind(last_command) if last_command else 0
+            if index >= 0 and \
+               prompt_regex.search(output[index + len(last_command):]):
+                break
+
+            # The banner may tell that the expected type was wrong, in which
+            # case the commands sent ahead are still waited for so that their
+            # output does not mix with the next ones
+            parser = NetworkOutputParser.get_parser_type(output)
+            if prepared and parser is not None and \
+               parser.device_type != self.network_parser.device_type:
+                logging.info("[%s] Expected a %s device, found a %s one",
+                             self.hostname, self.network_parser.device_type,
+                             parser.device_type)
+                prompt_regex = parser.prompt_regex
+                prepared = False
+
+            if time.time() >= deadline or self.shell.closed:
+                logging.warning("[%s] Device not ready, not a %s device?",
+                                self.hostname, self.network_parser.device_type)
+                return False, output
+
+        latency = time.time() - start_time
+        for command in commands:
+            self._record_latency(command, latency / len(commands))
+
+        return prepared, output
 
     def _prepare_switch(self):
         """
@@ -354,5 +944,114 @@ class NetworkExplorer(object):
         a key to skip the banner or as removing pagination.
         """
         for cmd in self.network_parser.preparation_cmds:
-            time.sleep(0.5)
             self._send_ssh_command(cmd)
+
+
+import unittest
+
+
+class _FakeShell(object):
+    """
+    A shell which sends back a fixed output once the commands are sent, and
+    is closed by the device afterwards.
+    """
+
+    def __init__(self, output):
+        self._output = output
+        self.sent = ""
+        self.closed = False
+
+    def send(self, data):
+        self.sent += data
+
+    def recv_ready(self):
+        return bool(self.sent and self._output)
+
+    def recv(self, size):
+        data, self._output = self._output[:size], self._output[size:]
+        self.closed = not self._output
+        return data
+
+
+class _FakeTransport(object):
+    """
+    An active transport on which every authentication raises the given
+    error.
+    """
+
+    def __init__(self, error):
+        self._error = error
+
+    def is_active(self):
+        return True
+
+    def auth_password(self, username, password):
+        raise self._error
+
+    def auth_publickey(self, username, key):
+        raise self._error
+
+
+class _FakeSSHClient(object):
+    def __init__(self, error):
+        self._transport = _FakeTransport(error)
+        self.closed = False
+
+    def get_transport(self):
+        return self._transport
+
+    def close(self):
+        self.closed = True
+
+
+class NetworkExplorerTester(unittest.TestCase):
+    def setUp(self):
+        self.explorer = NetworkExplorer(Device(system_name="switch"), None,
+                                        batch_size=3)
+        self.explorer.network_parser = HPNetworkOutputParser()
+        self.explorer._decoder = TerminalDecoder()
+        self.explorer._read_size = 16
+
+    def test_batch_cut_short(self):
+        # The device went away in the middle of the second output
+        self.explorer.shell = _FakeShell(
+            "show lldp info remote-device 1\r\n"
+            "  ChassisId : 00 11 22 33 44 55\r\n"
+            "  SysName   : core\r\n"
+            "switch# show lldp info remote-device 2\r\n"
+            "  ChassisId : 00 11")
+        details = self.explorer._send_ssh_commands(
+            ["show lldp info remote-device %d\n" % p for p in (1, 2, 3)])
+
+        self.assertEqual(len(details), 3)
+        self.assertTrue(details[0].endswith("switch# "))
+        self.assertEqual(details[2], u"")
+
+        neighbors = self.explorer.network_parser\
+            .parse_devices_from_lldp_remote_info(self.explorer.device,
+                                                 details)
+        self.assertEqual([n.system_name for n in neighbors], ["core", None])
+
+    def test_authenticate_after_connection_lost(self):
+        connections = []
+        self.explorer._connect = connections.append
+        self.explorer.ssh = _FakeSSHClient(
+            paramiko.SSHException("No existing session"))
+
+        self.explorer._authenticate({"username": "admin", "password": "x"})
+        self.assertEqual(connections, [{"username": "admin", "password": "x"}])
+
+    def test_authenticate_rejected(self):
+        connections = []
+        self.explorer._connect = connections.append
+        self.explorer.ssh = _FakeSSHClient(
+            paramiko.AuthenticationException("Rejected"))
+
+        self.assertRaises(paramiko.AuthenticationException,
+                          self.explorer._authenticate,
+                          {"username": "admin", "password": "x"})
+        self.assertEqual(connections, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
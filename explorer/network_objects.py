@@ -6,7 +6,7 @@ Auteur : Marc-Antoine Fortier
 Date   : Mars 2015
 """
 
-import json
+import re
 
 HP_DEVICES = ("HP", "Hewlett-Packard", "ProCurve")
 JUNIPER_DEVICES = ("Juniper", "JUNOS")
@@ -15,6 +15,25 @@ LINUX_DEVICES = ("Linux", "Debian", "Ubuntu")
 SUPPORTED_DEVICES = HP_DEVICES + JUNIPER_DEVICES + LINUX_DEVICES
 SUPPORTED_TYPES = ("bridge", "Bridge")
 
+MAC_ADDRESS_REGEX = re.compile(r"^([0-9a-f]{2})([ :\-]?[0-9a-f]{2}){5}$")
+
+
+def mac_address_to_bytes(mac_address):
+    """
+    Returns the 6 bytes of a MAC address written in any of the formats shown
+    by the devices ('00 1f fe 83 89 00', '00-1f-45-5d-48-2c', ...), or None
+    if the value is not a MAC address.
+    """
+    if not mac_address:
+        return None
+
+    mac_address = mac_address.strip().lower()
+    if not MAC_ADDRESS_REGEX.match(mac_address):
+        return None
+
+    hex_digits = re.sub(r"[ :\-]", "", mac_address)
+    return hex_digits.decode("hex")
+
 
 class VlanMode():
     TRUNK = "Tagged"
@@ -27,12 +46,26 @@ class VlanStatus():
 
 
 class NetworkObject(object):
-    def to_JSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__,
-                          sort_keys=False, indent=4)
+    # The attributes are declared by each class in __slots__, which saves
+    # the memory of a __dict__ per object
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, a) for a in self.__slots__)
+
+    def __setstate__(self, state):
+        for attribute, value in zip(self.__slots__, state):
+            setattr(self, attribute, value)
+
+    def to_JSON(self, indent=None):
+        # The serializer knows every class of this module
+        from serializer import dumps
+        return dumps(self, indent)
 
 
 class Vlan(NetworkObject):
+    __slots__ = ("identifier", "name", "mode", "status")
+
     def __init__(
             self,
             identifier=None,
@@ -46,7 +79,26 @@ class Vlan(NetworkObject):
         self.status = status
 
 
+class VlanTable(object):
+    """
+    Shares a single Vlan between the interfaces which have the same VLAN in
+    the same mode and status. The Vlans it returns must not be modified.
+    """
+
+    def __init__(self):
+        self._vlans = {}
+
+    def get(self, identifier, name, mode, status):
+        key = (identifier, name, mode, status)
+        vlan = self._vlans.get(key)
+        if vlan is None:
+            vlan = self._vlans[key] = Vlan(*key)
+        return vlan
+
+
 class VirtualMachine(NetworkObject):
+    __slots__ = ("identifier", "name", "state")
+
     def __init__(
             self,
             identifier=None,
@@ -67,6 +119,8 @@ class VirtualMachine(NetworkObject):
 
 
 class Trunk(NetworkObject):
+    __slots__ = ("name", "type", "group", "ports")
+
     def __init__(
             self,
             name=None,
@@ -81,6 +135,9 @@ class Trunk(NetworkObject):
 
 
 class Interface(NetworkObject):
+    __slots__ = ("local_port", "remote_port", "remote_mac_address",
+                 "remote_system_name", "vlans")
+
     def __init__(
             self,
             local_port=None,
@@ -111,9 +168,15 @@ class DeviceStatus():
     NO_AUTH_REQUESTED = "No authentication requested"
     AUTH_FAILED = "Authentication failed"
     UNREACHABLE = "Unreachable"
+    TIMED_OUT = "Timed out"
 
 
 class Device(NetworkObject):
+    __slots__ = ("mac_address", "ip_address", "ip_address_type",
+                 "system_name", "system_description",
+                 "supported_capabilities", "enabled_capabilities",
+                 "interfaces", "trunks", "virtual_machines", "status")
+
     def __init__(
             self,
             mac_address=None,
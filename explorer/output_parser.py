@@ -11,6 +11,11 @@ import logging
 
 from network_objects import *
 
+# Matches the end of a banner once the device is ready to receive commands:
+# either a prompt of any supported device or a "Press any key" message.
+BANNER_END_REGEX = re.compile(r"(\S+[#$>] |any key to continue\s*)$",
+                              re.IGNORECASE)
+
 
 class NetworkOutputParser(object):
     def __init__(self):
@@ -28,6 +33,20 @@ class NetworkOutputParser(object):
             elif "Cisco" in line:
                 return None
 
+    @staticmethod
+    def get_parser_for_type(device_type):
+        """
+        Returns the parser of a type of device, such as 'hp', or None if the
+        type is not supported.
+        """
+        parsers = {
+            "hp": HPNetworkOutputParser,
+            "juniper": JuniperNetworkOutputParser,
+            "linux": LinuxNetworkOutputParser}
+
+        parser = parsers.get(device_type)
+        return parser() if parser is not None else None
+
     def parse_device_from_lldp_local_info(self, result):
         raise NotImplementedError()
 
@@ -74,6 +93,10 @@ class CommonSwitchParser(NetworkOutputParser):
         devices = []
 
         for detail in neighbors_details:
+            # The output of a command may be missing from a batch cut short
+            if not detail:
+                continue
+
             neighbor = Device()
             for line in detail.splitlines():
                 if not ':' in line:
@@ -93,7 +116,13 @@ class CommonSwitchParser(NetworkOutputParser):
 class HPNetworkOutputParser(CommonSwitchParser):
     """Parses the output of Hewlett-Packard switches."""
     def __init__(self):
+        self.device_type = "hp"
         self.wait_string = "# "
+        self.prompt = r"\S+# "
+        self.prompt_regex = re.compile(self.prompt + "$")
+        self.line_prompt_regex = re.compile("(?m)^\r*" + self.prompt)
+        self.supports_batching = True
+        self.supports_exec_channels = False
         self.preparation_cmds = ["\n", "no page\n"]
         self.lldp_local_cmd = "show lldp info local-device\n"
         self.lldp_neighbors_cmd = "show lldp info remote-device\n"
@@ -104,6 +133,7 @@ class HPNetworkOutputParser(CommonSwitchParser):
         self.vms_list_cmd = None
 
         self.vlans_affected_to_trunks = {}
+        self.vlan_table = VlanTable()
 
     def parse_device_from_lldp_local_info(self, result):
         """
@@ -314,10 +344,11 @@ class HPNetworkOutputParser(CommonSwitchParser):
                     vlan_mode = line[mode_index:unknown_index-1].strip()
                     vlan_status = line[status_index:].strip()
 
-                    new_vlan = Vlan(identifier=vlan.identifier,
-                                    name=vlan.name,
-                                    mode=vlan_mode,
-                                    status=vlan_status)
+                    # Most ports share the same few modes and statuses
+                    new_vlan = self.vlan_table.get(vlan.identifier,
+                                                   vlan.name,
+                                                   vlan_mode,
+                                                   vlan_status)
 
                     if "Trk" in interface_id:
                         self._save_vlan_affected_to_trunk(new_vlan,
@@ -440,7 +471,13 @@ class HPNetworkOutputParser(CommonSwitchParser):
 class JuniperNetworkOutputParser(CommonSwitchParser):
     """Parses the output of Juniper switches."""
     def __init__(self):
+        self.device_type = "juniper"
         self.wait_string = "> "
+        self.prompt = r"\S+@\S+> "
+        self.prompt_regex = re.compile(self.prompt + "$")
+        self.line_prompt_regex = re.compile("(?m)^\r*" + self.prompt)
+        self.supports_batching = True
+        self.supports_exec_channels = False
         self.preparation_cmds = ["set cli screen-length 0\n",
                                  "set cli screen-width 0\n"]
         self.lldp_local_cmd = "show lldp local-information\n"
@@ -668,7 +705,15 @@ class JuniperNetworkOutputParser(CommonSwitchParser):
 class LinuxNetworkOutputParser(NetworkOutputParser):
     """Parses the output of Linux servers."""
     def __init__(self):
+        self.device_type = "linux"
         self.wait_string = "# "
+        self.prompt = r"\S+[#$] "
+        self.prompt_regex = re.compile(self.prompt + "$")
+        self.line_prompt_regex = re.compile("(?m)^\r*" + self.prompt)
+        # The terminal echoes the commands typed ahead in the middle of the
+        # output of the running command, so they cannot be batched.
+        self.supports_batching = False
+        self.supports_exec_channels = True
         self.preparation_cmds = []
         self.lldp_local_cmd = None
         self.lldp_neighbors_cmd = "lldpctl\n"
@@ -731,7 +776,13 @@ class LinuxNetworkOutputParser(NetworkOutputParser):
             neighbor = Device()
             interface = Interface()
 
-            interesting_lines = lldp_summary.splitlines()[4:]  # Skip header
+            # Skip the header, which ends with the separator following the
+            # title. The command itself may or may not be echoed before it.
+            lines = lldp_summary.splitlines()
+            start = next((i + 2 for i, line in enumerate(lines)
+                          if "LLDP neighbors:" in line), 4)
+
+            interesting_lines = lines[start:]
             for line in interesting_lines:
                 if ':' in line:
                     key, value = self._extract_key_and_value_from_line(line)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import time
+import errno
+import random
+import select
+import socket
+
+SSH_PORT = 22
+
+
+def _create_poller():
+    """
+    Returns an epoll object, or a poll object where epoll is not available,
+    along with the factor converting seconds into its unit of timeout.
+    Unlike select(), neither is limited to FD_SETSIZE file descriptors.
+    """
+    if hasattr(select, "epoll"):
+        return select.epoll(), select.EPOLLOUT, 1
+    return select.poll(), select.POLLOUT, 1000
+
+
+def probe_hosts(hostnames, port=SSH_PORT, timeout=2.0):
+    """
+    Checks which hosts accept TCP connections on the given port. Every
+    connection is attempted at the same time using non-blocking sockets, so
+    probing a batch of hosts takes at most 'timeout' seconds.
+
+    :param hostnames: The hosts to probe
+    :type hostnames: [str]
+    :return: Whether each host is reachable, by hostname
+    :rtype: {str : bool}
+    """
+    reachable = dict((h, False) for h in hostnames)
+    poller, writable_event, timeout_factor = _create_poller()
+
+    # Sockets and hosts of the pending connections, by file descriptor
+    pending = {}
+
+    for hostname in set(hostnames):
+        try:
+            family, socktype, proto, _, address = socket.getaddrinfo(
+                hostname, port, 0, socket.SOCK_STREAM)[0]
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(0)
+        except (socket.error, socket.gaierror, TypeError):
+            continue
+
+        error = sock.connect_ex(address)
+        if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            pending[sock.fileno()] = (sock, hostname)
+            poller.register(sock.fileno(), writable_event)
+        else:
+            sock.close()
+
+    deadline = time.time() + timeout
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+
+        for fd, _ in poller.poll(remaining * timeout_factor):
+            sock, hostname = pending.pop(fd)
+            poller.unregister(fd)
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            reachable[hostname] = error == 0
+            sock.close()
+
+    for sock, _ in pending.itervalues():
+        sock.close()
+    if hasattr(poller, "close"):
+        poller.close()
+
+    return reachable
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter between the attempts of an operation.
+    """
+
+    def __init__(self, max_attempts, base_delay=0.5, max_delay=8.0):
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        """
+        Returns the number of seconds to wait after the given failed attempt
+        (starting at 1) before trying again.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+
+import serializer
+
+
+class ResultSink(object):
+    """
+    Writes the explored devices one per line (NDJSON) as soon as they are
+    done, so that a crash or an interruption does not lose the devices
+    explored so far. The lines are written in a '.part' file which is renamed
+    once the crawl is over.
+    """
+
+    def __init__(self, outputfile, output_format="json"):
+        """
+        :param outputfile: The final JSON file, the NDJSON file being written
+                           next to it with the '.ndjson' extension
+        :type outputfile: str
+        :param output_format: The format of the final file, among
+                              serializer.FORMATS
+        :type output_format: str
+        """
+        self.output_format = output_format
+        self.outputfile = serializer.get_output_path(outputfile,
+                                                     output_format)
+        self.path = os.path.splitext(outputfile)[0] + ".ndjson"
+        self.part_path = self.path + ".part"
+
+        # Keeps the partial results of an interrupted run
+        if os.path.exists(self.part_path):
+            rotated_path = self.part_path + time.strftime(
+                ".%Y%m%d-%H%M%S",
+                time.localtime(os.path.getmtime(self.part_path)))
+            logging.warning("Moving the partial results of a previous run "
+                            "from %s to %s", self.part_path, rotated_path)
+            os.rename(self.part_path, rotated_path)
+
+        self._file = open(self.part_path, "w")
+        self._nb_lines = 0
+
+        # Line of each MAC address, and the lines replaced by a later one
+        self._lines = {}
+        self._superseded = set()
+
+    def __len__(self):
+        return len(self._lines)
+
+    def write(self, device):
+        """
+        Writes a device which is done. A device written again replaces the
+        previous line of the same MAC address in the final file.
+        """
+        previous = self._lines.get(device.mac_address)
+        if previous is not None:
+            self._superseded.add(previous)
+        self._lines[device.mac_address] = self._nb_lines
+
+        self._file.write(serializer.dumps(device) + "\n")
+        self._file.flush()
+        self._nb_lines += 1
+
+    def write_remaining(self, devices):
+        """
+        Writes the devices which were never written.
+
+        :param devices: Every device, by MAC address
+        :type devices: {str : Device}
+        """
+        for mac_address, device in devices.iteritems():
+            if mac_address not in self._lines:
+                self.write(device)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        self.close()
+        os.unlink(self.part_path)
+
+    def finalize(self, edges=None, vlan_analysis=None):
+        """
+        Completes the NDJSON file, then writes the final JSON file from it
+        line by line, without loading the whole document in memory. Both
+        files are replaced atomically.
+
+        :param edges: The result of Topology.get_edges(), written after the
+                      devices
+        :type edges: [dict]
+        :param vlan_analysis: The result of analysis.analyze_vlans(), written
+                              after the devices
+        :type vlan_analysis: dict
+        """
+        sections = [(k, v) for k, v in (("edges", edges),
+                                        ("vlan_analysis", vlan_analysis))
+                    if v is not None]
+
+        self.close()
+        os.rename(self.part_path, self.path)
+
+        temp_path = self.outputfile + ".tmp"
+        with open(self.path) as source, \
+                serializer.open_output(temp_path, self.output_format) as output:
+            if self.output_format == "msgpack":
+                self._write_msgpack(source, output, sections)
+            else:
+                self._write_json(source, output, sections)
+        os.rename(temp_path, self.outputfile)
+
+        logging.debug("Wrote %s device(s) to '%s' and '%s'", len(self),
+                      self.path, self.outputfile)
+
+    def _get_lines(self, source):
+        for number, line in enumerate(source):
+            if number not in self._superseded:
+                yield line.rstrip("\n")
+
+    def _write_json(self, source, output, sections):
+        output.write("{ \"date\": \"" + time.strftime("%c") + "\",\n")
+        output.write("\"devices\": [")
+
+        separator = ""
+        for line in self._get_lines(source):
+            output.write(separator + line)
+            separator = ",\n"
+
+        output.write("]")
+        for key, value in sections:
+            output.write(",\n\"%s\": " % key)
+            output.write(json.dumps(value,
+                                    separators=serializer.COMPACT_SEPARATORS))
+        output.write("}")
+
+    def _write_msgpack(self, source, output, sections):
+        packer = serializer.msgpack.Packer(use_bin_type=True)
+
+        # The number of devices is known, so they are packed one by one
+        output.write(packer.pack_map_header(2 + len(sections)))
+        output.write(packer.pack("date") + packer.pack(time.strftime("%c")))
+        output.write(packer.pack("devices"))
+        output.write(packer.pack_array_header(len(self)))
+
+        for line in self._get_lines(source):
+            output.write(packer.pack(json.loads(line)))
+
+        for key, value in sections:
+            output.write(packer.pack(key))
+            output.write(packer.pack(value))
+
+
+import shutil
+import tempfile
+import unittest
+from network_objects import Device
+
+
+class ResultSinkTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outputfile = os.path.join(self.directory, "devices.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_previous_part_kept(self):
+        with open(os.path.join(self.directory, "devices.ndjson.part"),
+                  "w") as _file:
+            _file.write("{}\n")
+
+        sink = ResultSink(self.outputfile)
+        rotated = [n for n in os.listdir(self.directory)
+                   if n.startswith("devices.ndjson.part.")]
+        self.assertEqual(len(rotated), 1)
+        with open(os.path.join(self.directory, rotated[0])) as _file:
+            self.assertEqual(_file.read(), "{}\n")
+        self.assertTrue(os.path.isfile(sink.part_path))
+
+    def test_streamed_then_assembled(self):
+        sink = ResultSink(self.outputfile)
+        sink.write(Device(mac_address="a", system_name="sw1"))
+        sink.write(Device(mac_address="b", system_name="sw2"))
+        self.assertTrue(os.path.isfile(sink.part_path))
+
+        sink.write(Device(mac_address="a", system_name="sw1", status="x"))
+        sink.write_remaining({"b": Device(mac_address="b"),
+                              "c": Device(mac_address="c")})
+        sink.finalize(edges=[{"from": "a", "to": "b"}],
+                      vlan_analysis={"orphans": {"a": ["20"]}})
+
+        self.assertFalse(os.path.exists(sink.part_path))
+        with open(sink.path) as _file:
+            self.assertEqual(len(_file.readlines()), 4)
+        with open(self.outputfile) as _file:
+            document = json.load(_file)
+        self.assertEqual(sorted(document), ["date", "devices", "edges",
+                                            "vlan_analysis"])
+        self.assertEqual([(d["mac_address"], d["status"])
+                          for d in document["devices"]],
+                         [("b", None), ("a", "x"), ("c", None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import fnmatch
+import itertools
+
+# Devices which reveal the most of the network come first
+VENDOR_CLASSES = {"hp": 0, "juniper": 0, "linux": 1}
+UNKNOWN_VENDOR_CLASS = 2
+
+
+class _Entry(object):
+    def __init__(self, device, depth, pinned, order):
+        self.device = device
+        self.depth = depth
+        self.pinned = pinned
+        self.order = order
+        # Number of devices which reported this one as their neighbor
+        self.degree = 0
+        # Only the last version pushed in the heap is still valid
+        self.version = 0
+        # The key under which the device is held, if any
+        self.held = None
+
+
+def _depth_priority(entry):
+    return entry.depth
+
+
+def _degree_priority(entry):
+    return -entry.degree
+
+
+def _vendor_priority(entry):
+    return VENDOR_CLASSES.get(entry.device.type, UNKNOWN_VENDOR_CLASS)
+
+
+POLICIES = {
+    "fifo": None,
+    "depth": _depth_priority,
+    "degree": _degree_priority,
+    "vendor": _vendor_priority}
+
+
+def _get_key(device):
+    return device.mac_address or device.system_name
+
+
+class CrawlScheduler(object):
+    """
+    Chooses which of the discovered devices is explored next. The devices are
+    ordered by the given policies, the first one being the most important,
+    then by order of discovery. Pinned devices always come first.
+    """
+
+    def __init__(self, policies=("fifo",), pinned=()):
+        """
+        :param policies: The names of the policies, among POLICIES
+        :type policies: [str]
+        :param pinned: The hostname patterns of the devices to explore first
+        :type pinned: [str]
+        """
+        for policy in policies:
+            if policy not in POLICIES:
+                raise ValueError("Unknown scheduling policy '%s'" % policy)
+
+        self._priorities = [POLICIES[p] for p in policies if POLICIES[p]]
+        self._pinned = [p.lower() for p in pinned]
+
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+        # Heaps of the devices set aside until their key is resumed, by key
+        self._held = {}
+        self._held_entries = {}
+        # The entry of the device popped last, which may be held
+        self._popped = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nb_held(self):
+        return len(self._held_entries)
+
+    def push(self, device, depth=0):
+        """
+        Adds a device to explore.
+
+        :param depth: The number of hops between the device and the seed
+        :type depth: int
+        """
+        name = (device.system_name or "").lower()
+        pinned = any(fnmatch.fnmatch(name, p) for p in self._pinned)
+
+        entry = _Entry(device, depth, pinned, next(self._counter))
+        self._entries[_get_key(device)] = entry
+        self._push_entry(entry)
+
+    def report(self, device):
+        """
+        Tells that a device was reported as a neighbor once more, which moves
+        it up when the 'degree' policy is used.
+        """
+        key = _get_key(device)
+        entry = self._entries.get(key) or self._held_entries.get(key)
+        if entry is None:
+            return
+
+        entry.degree += 1
+        if _degree_priority in self._priorities:
+            entry.version += 1
+            self._push_entry(entry)
+
+    def pop(self):
+        """
+        Removes and returns the next device to explore.
+        """
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            entry, version = item[-2], item[-1]
+            key = _get_key(entry.device)
+            if version == entry.version and self._entries.get(key) is entry:
+                del self._entries[key]
+                self._popped = entry
+                return entry.device
+
+        raise IndexError("pop from an empty scheduler")
+
+    def hold(self, device, key):
+        """
+        Sets aside the device popped last, which may not be explored yet,
+        such as a device whose throttle group is busy. It keeps its priority
+        and its degree, and is not popped again until its key is resumed.
+        """
+        entry = self._popped
+        if entry is None or entry.device is not device:
+            raise ValueError("Only the device popped last can be held")
+
+        self._popped = None
+        entry.held = key
+        entry.version += 1
+        self._held_entries[_get_key(device)] = entry
+        self._push_entry(entry)
+
+    def resume(self, key):
+        """
+        Puts back the first of the devices held under the given key, so that
+        it can be popped again.
+
+        :return: Whether a device was held under the key
+        :rtype: bool
+        """
+        heap = self._held.get(key, [])
+        while heap:
+            item = heapq.heappop(heap)
+            entry, version = item[-2], item[-1]
+            device_key = _get_key(entry.device)
+            if version == entry.version and \
+               self._held_entries.get(device_key) is entry:
+                del self._held_entries[device_key]
+                entry.held = None
+                entry.version += 1
+                self._entries[device_key] = entry
+                self._push_entry(entry)
+                return True
+
+        self._held.pop(key, None)
+        return False
+
+    def _push_entry(self, entry):
+        priority = [not entry.pinned]
+        priority.extend(p(entry) for p in self._priorities)
+        heap = self._heap if entry.held is None \
+            else self._held.setdefault(entry.held, [])
+        heapq.heappush(heap,
+                       tuple(priority) + (entry.order, entry, entry.version))
+
+
+import unittest
+from network_objects import Device
+
+
+class CrawlSchedulerTester(unittest.TestCase):
+    def _device(self, name, description="HP ProCurve"):
+        return Device(mac_address=name, system_name=name,
+                      system_description=description)
+
+    def _pop_all(self, scheduler):
+        return [scheduler.pop().system_name for _ in range(len(scheduler))]
+
+    def test_switches_first_then_by_degree(self):
+        scheduler = CrawlScheduler(["vendor", "degree"], pinned=["host9"])
+        for name in ("host1", "edge1", "edge2", "host9"):
+            description = "Debian Linux" if name.startswith("host") \
+                else "HP ProCurve"
+            scheduler.push(self._device(name, description))
+        scheduler.report(self._device("edge2"))
+
+        self.assertEqual(self._pop_all(scheduler),
+                         ["host9", "edge2", "edge1", "host1"])
+
+    def test_fifo_keeps_discovery_order(self):
+        scheduler = CrawlScheduler()
+        for name in ("c", "a", "b"):
+            scheduler.push(self._device(name))
+        scheduler.report(self._device("b"))
+
+        self.assertEqual(self._pop_all(scheduler), ["c", "a", "b"])
+        self.assertRaises(IndexError, scheduler.pop)
+
+    def test_held_devices_keep_their_priority(self):
+        scheduler = CrawlScheduler(["degree"])
+        for name in ("a", "b", "c", "d"):
+            scheduler.push(self._device(name))
+        for name in ("c", "c", "d"):
+            scheduler.report(self._device(name))
+
+        for name in ("c", "d"):
+            scheduler.hold(scheduler.pop(), "site")
+        self.assertEqual(scheduler.nb_held, 2)
+        self.assertEqual(scheduler.pop().system_name, "a")
+
+        # A held device still gets reported
+        scheduler.report(self._device("d"))
+        scheduler.report(self._device("d"))
+        self.assertTrue(scheduler.resume("site"))
+        self.assertEqual(self._pop_all(scheduler), ["d", "b"])
+        self.assertTrue(scheduler.resume("site"))
+        self.assertFalse(scheduler.resume("site"))
+        self.assertEqual(self._pop_all(scheduler), ["c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
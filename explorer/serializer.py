@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+Explicit encoding of the network objects, field by field, instead of
+walking their __dict__ through a json.dumps() callback.
+"""
+
+import os
+import json
+import gzip
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from network_objects import Device, Interface, Trunk, Vlan, VirtualMachine
+
+FORMATS = ("json", "json.gz", "msgpack")
+
+COMPACT_SEPARATORS = (",", ":")
+
+
+def _vlan_to_dict(vlan):
+    return {"identifier": vlan.identifier,
+            "name": vlan.name,
+            "mode": vlan.mode,
+            "status": vlan.status}
+
+
+def _virtual_machine_to_dict(virtual_machine):
+    return {"identifier": virtual_machine.identifier,
+            "name": virtual_machine.name,
+            "state": virtual_machine.state}
+
+
+def _trunk_to_dict(trunk):
+    return {"name": trunk.name,
+            "type": trunk.type,
+            "group": trunk.group,
+            "ports": list(trunk.ports)}
+
+
+def _interface_to_dict(interface):
+    return {"local_port": interface.local_port,
+            "remote_port": interface.remote_port,
+            "remote_mac_address": interface.remote_mac_address,
+            "remote_system_name": interface.remote_system_name,
+            "vlans": dict((k, _vlan_to_dict(v))
+                          for k, v in interface.vlans.iteritems())}
+
+
+def _device_to_dict(device):
+    return {"mac_address": device.mac_address,
+            "ip_address": device.ip_address,
+            "ip_address_type": device.ip_address_type,
+            "system_name": device.system_name,
+            "system_description": device.system_description,
+            "supported_capabilities": device.supported_capabilities,
+            "enabled_capabilities": device.enabled_capabilities,
+            "interfaces": dict((k, _interface_to_dict(v))
+                               for k, v in device.interfaces.iteritems()),
+            "trunks": dict((k, _trunk_to_dict(v))
+                           for k, v in device.trunks.iteritems()),
+            "virtual_machines": [_virtual_machine_to_dict(v)
+                                 for v in device.virtual_machines],
+            "status": device.status}
+
+
+_ENCODERS = {
+    Device: _device_to_dict,
+    Interface: _interface_to_dict,
+    Trunk: _trunk_to_dict,
+    Vlan: _vlan_to_dict,
+    VirtualMachine: _virtual_machine_to_dict}
+
+
+def to_dict(obj):
+    """
+    Returns the fields of a network object as plain dicts and lists.
+    """
+    return _ENCODERS[type(obj)](obj)
+
+
+def dumps(obj, indent=None):
+    """
+    Encodes a network object as JSON, compact unless an indent is given.
+    """
+    separators = COMPACT_SEPARATORS if indent is None else None
+    return json.dumps(to_dict(obj), indent=indent, separators=separators)
+
+
+def dumps_binary(obj):
+    """
+    Encodes a network object with MessagePack.
+    """
+    if msgpack is None:
+        raise RuntimeError("The msgpack module is required by the "
+                           "'msgpack' format")
+    return msgpack.packb(to_dict(obj), use_bin_type=True)
+
+
+def get_output_path(outputfile, output_format):
+    """
+    Returns the name of the output file with the extension of its format,
+    such as 'devices.json.gz' for 'devices.json' in the 'json.gz' format.
+    """
+    if output_format == "json.gz" and not outputfile.endswith(".gz"):
+        return outputfile + ".gz"
+    elif output_format == "msgpack":
+        return os.path.splitext(outputfile)[0] + ".msgpack"
+    return outputfile
+
+
+def open_output(path, output_format):
+    """
+    Opens a file to write in the given format, compressed for 'json.gz'.
+    """
+    if output_format == "json.gz":
+        return gzip.open(path, "wb")
+    return open(path, "wb")
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import re
+import codecs
+
+# ANSI and VT100 escape sequences, once the escape characters are removed
+ANSI_ESCAPE_REGEX = re.compile(
+    r"\[\d{1,2}\;\d{1,2}[a-zA-Z]?\d?|\[\??\d{1,2}[a-zA-Z]")
+
+# Start of an escape sequence which may continue in the next chunk
+PARTIAL_ESCAPE_REGEX = re.compile(
+    r"\[(\??\d{0,2}|\d{1,2}\;\d{0,2}|\d{1,2}\;\d{1,2}[a-zA-Z])$")
+
+ESCAPE_CHARACTER = u"\u001b"
+
+
+class TerminalDecoder(object):
+    """
+    Decodes the raw output of a terminal, chunk by chunk, into clean text.
+
+    Multi-byte UTF-8 characters and escape sequences may be split between
+    two chunks, so their beginning is kept until the next chunk arrives.
+    """
+
+    def __init__(self, encoding="utf8"):
+        self._decoder = codecs.getincrementaldecoder(encoding)("replace")
+        self._pending = u""
+
+    def decode(self, data, final=False):
+        """
+        Decodes a chunk of raw output.
+
+        :param data: The raw output
+        :type data: str
+        :param final: Whether this is the last chunk of the output, in which
+                      case nothing is kept for the next chunk
+        :type final: bool
+        :return: Returns the cleaned text
+        :rtype: unicode
+        """
+        text = self._decoder.decode(data, final)
+        text = self._pending + text.replace(ESCAPE_CHARACTER, u"")
+        self._pending = u""
+
+        if not final:
+            partial = PARTIAL_ESCAPE_REGEX.search(text[-8:])
+            if partial:
+                cut = len(text) - len(partial.group(0))
+                text, self._pending = text[:cut], text[cut:]
+
+        return ANSI_ESCAPE_REGEX.sub(u"", text)
+
+    def flush(self):
+        """
+        Returns what was kept from the previous chunks.
+        """
+        return self.decode("", final=True)
+
+
+class ReceiveBuffer(object):
+    """
+    Accumulates the chunks of an output without copying them, while keeping
+    the end of the output at hand in order to look for a prompt.
+    """
+
+    def __init__(self, tail_length=256):
+        self._chunks = []
+        self._tail_length = tail_length
+        self.tail = u""
+        self.length = 0
+
+    def append(self, text):
+        self._chunks.append(text)
+        self.length += len(text)
+        self.tail = (self.tail + text)[-self._tail_length:]
+
+    def getvalue(self):
+        if len(self._chunks) > 1:
+            self._chunks = [u"".join(self._chunks)]
+        return self._chunks[0] if self._chunks else u""
+
+
+class PromptCounter(object):
+    """
+    Counts the prompts found at the start of a line of an output received
+    chunk by chunk. Only the line being received is kept, so that each chunk
+    is scanned once however long the output gets.
+    """
+
+    def __init__(self, line_prompt_regex):
+        self._regex = line_prompt_regex
+        self._line = u""
+        self._position = 0
+        self.count = 0
+
+    def feed(self, text):
+        """
+        Scans the next chunk of the output.
+
+        :param text: The decoded chunk
+        :type text: unicode
+        :return: Returns the number of prompts found so far
+        :rtype: int
+        """
+        self._line += text
+        for match in self._regex.finditer(self._line, self._position):
+            self.count += 1
+            self._position = match.end()
+
+        # The complete lines are not scanned again
+        line_start = self._line.rfind(u"\n") + 1
+        if line_start:
+            self._position = max(self._position - line_start, 0)
+            self._line = self._line[line_start:]
+
+        return self.count
+
+
+import unittest
+
+
+class TerminalDecoderTester(unittest.TestCase):
+    def setUp(self):
+        self.decoder = TerminalDecoder()
+
+    def _decode_chunks(self, chunks):
+        text = u"".join(self.decoder.decode(c) for c in chunks)
+        return text + self.decoder.flush()
+
+    def test_escape_sequences(self):
+        text = self._decode_chunks(["\x1b[24;1HSwitch\x1b[?25h# "])
+        self.assertEqual(text, u"Switch# ")
+
+    def test_escape_sequence_split_between_chunks(self):
+        text = self._decode_chunks(["A1 Up\x1b[2", "4;", "1H\x1b[?2", "5hA2"])
+        self.assertEqual(text, u"A1 UpA2")
+
+    def test_multibyte_character_split_between_chunks(self):
+        raw = u" ID    Nom    État".encode("utf8")
+        index = raw.find("\xc3") + 1
+        text = self._decode_chunks([raw[:index], raw[index:]])
+        self.assertEqual(text, u" ID    Nom    État")
+
+    def test_pending_text_is_flushed(self):
+        self.assertEqual(self.decoder.decode("[[x] [2"), u"[[x] ")
+        self.assertEqual(self.decoder.flush(), u"[2")
+
+    def test_receive_buffer(self):
+        receive_buffer = ReceiveBuffer(tail_length=4)
+        for chunk in (u"show ", u"vlans\r\n", u"Switch# "):
+            receive_buffer.append(chunk)
+        self.assertEqual(receive_buffer.getvalue(), u"show vlans\r\nSwitch# ")
+        self.assertEqual(receive_buffer.tail, u"ch# ")
+        self.assertEqual(receive_buffer.length, 20)
+
+    def test_prompts_counted_across_chunks(self):
+        counter = PromptCounter(re.compile(r"(?m)^\r*\S+# "))
+        counts = [counter.feed(chunk) for chunk in (
+            u"Switch# show vlans\r\nID # Name\r\n\rSwi", u"tch# sh",
+            u"ow trunks\r\n", u"Switch#", u" ")]
+        self.assertEqual(counts, [1, 2, 2, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import struct
+import fnmatch
+
+THROTTLE_SECTION_PREFIX = "Throttle."
+
+
+def _ip_to_int(ip_address):
+    try:
+        return struct.unpack("!I", socket.inet_aton(ip_address))[0]
+    except (socket.error, TypeError):
+        return None
+
+
+def _parse_subnet(subnet):
+    """
+    Returns the network and the mask of a subnet such as '10.0.0.0/8'.
+    """
+    address, _, length = subnet.partition("/")
+    network = _ip_to_int(address.strip())
+    if network is None:
+        raise ValueError("Invalid subnet '%s'" % subnet)
+
+    length = int(length) if length else 32
+    mask = (0xffffffff << (32 - length)) & 0xffffffff
+    return network & mask, mask
+
+
+def _get_list(parser, section, option):
+    if not parser.has_option(section, option):
+        return []
+    return [v.strip() for v in parser.get(section, option).split(",")
+            if v.strip()]
+
+
+class TokenBucket(object):
+    """
+    Allows 'rate' operations per second on average, and at most 'capacity'
+    operations at once.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last_time = None
+
+    def take(self, now):
+        """
+        Takes a token if there is one.
+
+        :param now: The current time
+        :type now: float
+        :return: 0 if the token was taken, or the number of seconds to wait
+                 until the next one
+        :rtype: float
+        """
+        if self._last_time is not None:
+            elapsed = now - self._last_time
+            self._tokens = min(self.capacity,
+                               self._tokens + elapsed * self.rate)
+        self._last_time = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class ThrottleGroup(object):
+    """
+    A group of devices which share the same limits, such as the devices
+    behind the same uplink.
+    """
+
+    def __init__(self, name, subnets=None, hosts=None, types=None,
+                 max_sessions=None, connections_per_second=None, burst=1):
+        """
+        :param subnets: The subnets of the devices, such as '10.1.0.0/16'
+        :type subnets: [str]
+        :param hosts: The hostname patterns of the devices
+        :type hosts: [str]
+        :param types: The types of the devices, such as 'hp'
+        :type types: [str]
+        :param max_sessions: The number of devices explored at the same time
+        :type max_sessions: int
+        :param connections_per_second: The number of new connections per
+                                       second, on average
+        :type connections_per_second: float
+        """
+        self.name = name
+        self.subnets = [_parse_subnet(s) for s in subnets or []]
+        self.hosts = [h.lower() for h in hosts or []]
+        self.types = types or []
+        self.max_sessions = max_sessions
+        if max_sessions is not None and max_sessions < 1:
+            raise ValueError("Invalid number of sessions for the throttle "
+                             "group '%s'" % name)
+
+        self.bucket = None
+        if connections_per_second:
+            self.bucket = TokenBucket(connections_per_second, burst)
+
+        self.sessions = 0
+        self.throttled_time = 0
+
+    @classmethod
+    def from_config(cls, parser, section):
+        def get(option, getter, default=None):
+            if not parser.has_option(section, option):
+                return default
+            return getter(section, option)
+
+        return cls(section[len(THROTTLE_SECTION_PREFIX):],
+                   subnets=_get_list(parser, section, "Subnets"),
+                   hosts=_get_list(parser, section, "Hosts"),
+                   types=_get_list(parser, section, "Types"),
+                   max_sessions=get("MaxSessions", parser.getint),
+                   connections_per_second=get("ConnectionsPerSecond",
+                                              parser.getfloat),
+                   burst=get("Burst", parser.getint, 1))
+
+    def matches(self, device):
+        if device.type is not None and device.type in self.types:
+            return True
+
+        name = (device.system_name or "").lower()
+        if any(fnmatch.fnmatch(name, h) for h in self.hosts):
+            return True
+
+        address = _ip_to_int(device.ip_address)
+        if address is not None:
+            return any(address & mask == network
+                       for network, mask in self.subnets)
+
+        return False
+
+
+class Throttle(object):
+    """
+    Limits the number of sessions and the rate of new connections of each
+    group of devices. A device belongs to the first group it matches, and
+    the devices of no group are not limited.
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups: The groups of devices, in order
+        :type groups: [ThrottleGroup]
+        """
+        self.groups = groups
+
+    def get_group(self, device):
+        for group in self.groups:
+            if group.matches(device):
+                return group
+        return None
+
+    def acquire(self, device, now):
+        """
+        Starts a session with a device if its group allows it.
+
+        :param now: The current time
+        :type now: float
+        :return: 0 if the session is started, or the number of seconds to
+                 wait before trying again (None when waiting for a session
+                 to end)
+        :rtype: float
+        """
+        group = self.get_group(device)
+        if group is None:
+            return 0
+
+        if group.max_sessions is not None and \
+           group.sessions >= group.max_sessions:
+            return None
+
+        if group.bucket is not None:
+            delay = group.bucket.take(now)
+            if delay > 0:
+                return delay
+
+        group.sessions += 1
+        return 0
+
+    def release(self, device):
+        """
+        Ends the session started with a device.
+        """
+        group = self.get_group(device)
+        if group is not None:
+            group.sessions -= 1
+
+
+def load_throttle(parser):
+    """
+    Returns the throttle defined by the [Throttle.*] sections of the
+    configuration, or None if there is none.
+    """
+    groups = [ThrottleGroup.from_config(parser, s) for s in parser.sections()
+              if s.startswith(THROTTLE_SECTION_PREFIX)]
+    return Throttle(groups) if groups else None
+
+
+import unittest
+from network_objects import Device
+
+
+class ThrottleTester(unittest.TestCase):
+    def setUp(self):
+        self.throttle = Throttle([
+            ThrottleGroup("site", subnets=["10.1.0.0/16"], max_sessions=1),
+            ThrottleGroup("hp", types=["hp"], connections_per_second=2)])
+
+    def test_groups(self):
+        site = Device(ip_address="10.1.2.3", system_description="ProCurve")
+        hp = Device(ip_address="10.2.0.1", system_description="ProCurve")
+        other = Device(ip_address="10.2.0.1", system_description="Debian")
+        self.assertEqual(self.throttle.get_group(site).name, "site")
+        self.assertEqual(self.throttle.get_group(hp).name, "hp")
+        self.assertIsNone(self.throttle.get_group(other))
+
+    def test_max_sessions(self):
+        device = Device(ip_address="10.1.2.3")
+        self.assertEqual(self.throttle.acquire(device, 0), 0)
+        self.assertIsNone(self.throttle.acquire(device, 0))
+        self.throttle.release(device)
+        self.assertEqual(self.throttle.acquire(device, 0), 0)
+
+    def test_connections_per_second(self):
+        device = Device(system_description="ProCurve")
+        self.assertEqual(self.throttle.acquire(device, 10.0), 0)
+        self.assertEqual(self.throttle.acquire(device, 10.25), 0.25)
+        self.assertEqual(self.throttle.acquire(device, 10.5), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+
+def _same_port(a, b):
+    """
+    Tells whether two port names designate the same port, a name ending
+    with '..' being a prefix (as in 'comparePortNames' of networkmap.js).
+    """
+    if a is None or b is None:
+        return False
+    if a == b:
+        return True
+    for x, y in ((a, b), (b, a)):
+        index = x.find("..")
+        if index > 0 and x[:index] in y:
+            return True
+    return False
+
+
+def _natural_key(port):
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", port)]
+
+
+def _fold_trunks(device, ports):
+    """
+    Replaces the ports which are members of a trunk of the device by the
+    trunk, and sorts them in natural order ('2' before '10').
+    """
+    trunk_of = {}
+    for group, trunk in device.trunks.iteritems():
+        for port in trunk.ports:
+            trunk_of[port] = group
+
+    folded = set(trunk_of.get(p, p) for p in ports if p is not None)
+    return sorted(folded, key=_natural_key)
+
+
+class Topology(object):
+    """
+    The explored devices indexed by MAC address, with the interfaces of each
+    device towards each of its explored neighbors.
+    """
+
+    def __init__(self, devices):
+        """
+        :param devices: The explored devices, by MAC address
+        :type devices: {str : Device}
+        """
+        self.devices = devices
+
+        # {MAC address : {MAC address of a neighbor : [Interface]}}
+        self.adjacency = {}
+        for mac_address, device in devices.iteritems():
+            towards = self.adjacency[mac_address] = {}
+            for interface in device.interfaces.itervalues():
+                if interface.remote_mac_address in devices:
+                    towards.setdefault(interface.remote_mac_address,
+                                       []).append(interface)
+
+    def get_neighbors(self, mac_address):
+        """
+        Returns the MAC addresses of the explored neighbors of a device.
+        """
+        return self.adjacency.get(mac_address, {}).keys()
+
+    def get_interfaces(self, mac_address, remote_mac_address):
+        """
+        Returns the interfaces of a device connected to one of its neighbors.
+        """
+        return self.adjacency.get(mac_address, {}).get(remote_mac_address,
+                                                       [])
+
+    def get_links(self):
+        """
+        Returns the links between the explored devices, once each. A link
+        joins two interfaces which report each other as their remote port.
+
+        :return: The (device, interface, remote device, remote interface)
+                 tuples
+        :rtype: [tuple]
+        """
+        links = []
+        for mac_address, towards in self.adjacency.iteritems():
+            for remote_mac_address, interfaces in towards.iteritems():
+                if remote_mac_address <= mac_address:
+                    continue
+
+                remote_interfaces = self.get_interfaces(remote_mac_address,
+                                                        mac_address)
+                for interface in interfaces:
+                    for remote_interface in remote_interfaces:
+                        if _same_port(interface.remote_port,
+                                      remote_interface.local_port) and \
+                           _same_port(remote_interface.remote_port,
+                                      interface.local_port):
+                            links.append((self.devices[mac_address],
+                                          interface,
+                                          self.devices[remote_mac_address],
+                                          remote_interface))
+        return links
+
+    def get_edges(self):
+        """
+        Returns one edge per pair of neighbor devices, whatever the number of
+        links between them, with the ports of the links on both ends. The
+        ports which are members of a trunk are folded into the trunk.
+
+        :return: The 'from' and 'to' MAC addresses and the 'from_ports' and
+                 'to_ports' of each edge
+        :rtype: [dict]
+        """
+        edges = []
+        for mac_address, towards in self.adjacency.iteritems():
+            for remote_mac_address, interfaces in towards.iteritems():
+                remote_interfaces = self.get_interfaces(remote_mac_address,
+                                                        mac_address)
+                # An edge seen from both ends starts from the lowest address
+                if remote_interfaces and remote_mac_address < mac_address:
+                    continue
+
+                if remote_interfaces:
+                    remote_ports = [i.local_port for i in remote_interfaces]
+                else:
+                    remote_ports = [i.remote_port for i in interfaces]
+
+                edges.append({
+                    "from": mac_address,
+                    "to": remote_mac_address,
+                    "from_ports": _fold_trunks(
+                        self.devices[mac_address],
+                        [i.local_port for i in interfaces]),
+                    "to_ports": _fold_trunks(
+                        self.devices[remote_mac_address], remote_ports)})
+        return edges
+
+
+import unittest
+from network_objects import Device, Interface, Trunk
+
+
+class TopologyTester(unittest.TestCase):
+    def _interface(self, local_port, remote_mac_address, remote_port):
+        return Interface(local_port=local_port, remote_port=remote_port,
+                         remote_mac_address=remote_mac_address)
+
+    def setUp(self):
+        a = Device(mac_address="a", trunks={
+            "Trk1": Trunk("Trk1", group="Trk1", ports=["47", "48"])})
+        for interface in (self._interface("47", "b", "ge-0/0/1.."),
+                          self._interface("48", "b", "ge-0/0/2.."),
+                          self._interface("10", "c", "eth0"),
+                          self._interface("2", "c", "eth1"),
+                          self._interface("5", "unexplored", "1")):
+            a.interfaces[interface.local_port] = interface
+
+        b = Device(mac_address="b")
+        for interface in (self._interface("ge-0/0/1.0", "a", "47"),
+                          self._interface("ge-0/0/2.0", "a", "48")):
+            b.interfaces[interface.local_port] = interface
+
+        c = Device(mac_address="c")
+        self.topology = Topology({"a": a, "b": b, "c": c})
+
+    def test_adjacency(self):
+        self.assertEqual(sorted(self.topology.get_neighbors("a")),
+                         ["b", "c"])
+        self.assertEqual(self.topology.get_neighbors("c"), [])
+        self.assertEqual(len(self.topology.get_interfaces("b", "a")), 2)
+
+    def test_links(self):
+        self.assertEqual(sorted((i.local_port, r.local_port)
+                                for _, i, _, r in self.topology.get_links()),
+                         [("47", "ge-0/0/1.0"), ("48", "ge-0/0/2.0")])
+
+    def test_edges(self):
+        edges = sorted(self.topology.get_edges(), key=lambda e: e["to"])
+        self.assertEqual(edges, [
+            {"from": "a", "to": "b", "from_ports": ["Trk1"],
+             "to_ports": ["ge-0/0/1.0", "ge-0/0/2.0"]},
+            {"from": "a", "to": "c", "from_ports": ["2", "10"],
+             "to_ports": ["eth0", "eth1"]}])
+
+
+if __name__ == "__main__":
+    unittest.main()
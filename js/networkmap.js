@@ -1,5 +1,7 @@
 const jsonFile = "devices.json";
 var devices = null;
+var devicesByMac = {};
+var precomputedEdges = null;
 var generationDate = null;
 
 // The JSON must be fully loaded before onload() happens for calling draw() on 'devices'
@@ -11,6 +13,13 @@ $.ajaxSetup({
 $.getJSON(jsonFile, function(json) {
     devices = json.devices;
     generationDate = json.date;
+
+    // Files written by older versions of the explorer have no 'edges'
+    precomputedEdges = json.edges || null;
+
+    for (var i = 0; i < devices.length; i++) {
+        devicesByMac[devices[i].mac_address] = devices[i];
+    }
 });
 
 // The objects used by vis
@@ -202,6 +211,10 @@ function createVmsNodes(device) {
  * Create the edges used by vis.js
  */
 function createEdges() {
+    if (precomputedEdges != null) {
+        return createPrecomputedEdges();
+    }
+
     for (var i = 0; i < devices.length; i++) {
         device = devices[i];
 
@@ -243,6 +256,56 @@ function createEdges() {
     return edges;
 }
 
+/**
+ * Create the edges used by vis.js from the edges computed by the explorer
+ */
+function createPrecomputedEdges() {
+    for (var i = 0; i < precomputedEdges.length; i++) {
+        var edge = precomputedEdges[i];
+
+        edges.push(
+            {
+                'from': edge.from,
+                'to': edge.to,
+                'style': "line",
+                'color': undefined,
+                'width': 2,
+                'labelFrom': stringifyPorts(edge.from_ports, getDevice(edge.from)),
+                'labelTo': stringifyPorts(edge.to_ports, getDevice(edge.to))
+            });
+    }
+
+    for (var i = 0; i < devices.length; i++) {
+        for (var index in devices[i].interfaces) {
+            var int = devices[i].interfaces[index];
+
+            for (var id in int.vlans) {
+                if (!(id in myVlans)) {
+                    myVlans[id] = int.vlans[id];
+                }
+            }
+        }
+    }
+
+    return edges;
+}
+
+/**
+ * Returns the label of the ports of a device at one end of an edge, a trunk
+ * being shown with its ports.
+ */
+function stringifyPorts(ports, device) {
+    if (ports.length == 1) {
+        var trunk = device.trunks[ports[0]];
+        if (trunk) {
+            return getStringifiedTrunk(trunk.ports[0], device);
+        }
+        return ports[0];
+    }
+
+    return "(" + ports.join(" ") + ")";
+}
+
 /**
  * Build the edge labels depending if the link is trunked or not.
  */
@@ -997,11 +1060,7 @@ function getVlansOnInterface(int) {
  * Get a device from its mac address
  */
 function getDevice(mac) {
-    for (var i = 0; i < devices.length; i++) {
-        if (devices[i].mac_address == mac) {
-            return devices[i];
-        }
-    }
+    return devicesByMac[mac];
 }
 
 /**